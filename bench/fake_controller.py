@@ -0,0 +1,268 @@
+import asyncio
+import argparse
+import random
+import secrets
+import socket
+import threading
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+# ------------------------------------------------------
+# SIMULADOR DE CONTROLADOR UNIFI (bench / pruebas sin hardware)
+# ------------------------------------------------------
+# Dialectos (los mismos que services/unifi_async.py):
+#   2 / 4 (UniFi OS, UDM) → POST /api/auth/login, cookie TOKEN
+#                           /proxy/network/api/s/<site>/cmd/stamgr
+#   3     (controlador clásico / CloudKey) → POST /api/login, cookie unifises
+#                           /api/s/<site>/cmd/stamgr
+# En todos el CSRF sale en el header X-Csrf-Token del login y hay que
+# mandarlo (junto con la cookie) en cada comando.
+#
+# Inyección de fallas (todas configurables en caliente con POST /_sim/config):
+#   latency_ms / jitter_ms → demora de cada respuesta
+#   error_rate            → fracción de requests que devuelven 500
+#   timeout_rate          → fracción que se cuelga hang_s segundos (timeout del cliente)
+#   session_ttl           → segundos de vida de la sesión; después 401 (0 = no vence)
+#   expire_every          → cada N comandos se invalidan las sesiones → 401 y re-login
+#   login_fail_rate       → fracción de logins rechazados (401)
+DEFAULTS = {
+    "modelo": None,          # None = acepta los tres dialectos; 2/3/4 = solo ese
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "error_rate": 0.0,
+    "timeout_rate": 0.0,
+    "hang_s": 30.0,
+    "session_ttl": 0.0,
+    "expire_every": 0,
+    "login_fail_rate": 0.0,
+    "username": None,        # None = acepta cualquier usuario/clave
+    "password": None,
+    "seed": None,
+}
+
+DIALECTO = {2: "unifi_os", 3: "classic", 4: "unifi_os"}
+COOKIE = {"unifi_os": "TOKEN", "classic": "unifises"}
+COUNTERS = (
+    "login", "login_failed", "authorize-guest", "unauthorize-guest",
+    "expired", "rejected", "errors", "timeouts",
+)
+
+
+def create_app(**options) -> FastAPI:
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Opciones desconocidas: {', '.join(sorted(unknown))}")
+
+    app = FastAPI(title="UniFi controller simulator")
+    sim = {**DEFAULTS, **options}
+    state = {
+        "sessions": {},            # csrf → (cookie, vence en monotonic | None)
+        "commands": 0,
+        "counters": dict.fromkeys(COUNTERS, 0),
+        "rng": random.Random(sim["seed"]),
+    }
+    app.state.sim = sim
+    app.state.sim_state = state
+
+    def _count(name):
+        state["counters"][name] += 1
+
+    async def _delay():
+        delay = sim["latency_ms"]
+        if sim["jitter_ms"]:
+            delay += state["rng"].uniform(-sim["jitter_ms"], sim["jitter_ms"])
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def _faults():
+        """500 / cuelgue según las tasas configuradas; None si la request sigue."""
+        rng = state["rng"]
+        if sim["timeout_rate"] and rng.random() < sim["timeout_rate"]:
+            _count("timeouts")
+            await asyncio.sleep(sim["hang_s"])
+            return JSONResponse({"meta": {"rc": "error", "msg": "timeout"}}, status_code=504)
+        if sim["error_rate"] and rng.random() < sim["error_rate"]:
+            _count("errors")
+            return JSONResponse({"meta": {"rc": "error", "msg": "api.err.Internal"}}, status_code=500)
+        return None
+
+    def _dialect_ok(dialecto):
+        return sim["modelo"] is None or DIALECTO.get(sim["modelo"]) == dialecto
+
+    def _login_required():
+        return JSONResponse({"meta": {"rc": "error", "msg": "api.err.LoginRequired"}}, status_code=401)
+
+    async def _login(request: Request, dialecto: str):
+        if not _dialect_ok(dialecto):
+            return JSONResponse({"error": "not found"}, status_code=404)
+        await _delay()
+        fault = await _faults()
+        if fault is not None:
+            return fault
+
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        bad_creds = (
+            (sim["username"] is not None and body.get("username") != sim["username"])
+            or (sim["password"] is not None and body.get("password") != sim["password"])
+        )
+        if bad_creds or (sim["login_fail_rate"] and state["rng"].random() < sim["login_fail_rate"]):
+            _count("login_failed")
+            return JSONResponse({"meta": {"rc": "error", "msg": "api.err.Invalid"}}, status_code=401)
+
+        _count("login")
+        csrf, cookie = secrets.token_hex(16), secrets.token_hex(16)
+        expires = time.monotonic() + sim["session_ttl"] if sim["session_ttl"] else None
+        state["sessions"][csrf] = (cookie, expires)
+
+        r = JSONResponse({"meta": {"rc": "ok"}, "data": []})
+        r.headers["X-Csrf-Token"] = csrf
+        r.set_cookie(COOKIE[dialecto], cookie)
+        return r
+
+    def _session_valid(request: Request, dialecto: str) -> bool:
+        csrf = request.headers.get("x-csrf-token")
+        session = state["sessions"].get(csrf)
+        if session is None:
+            return False
+        cookie, expires = session
+        if request.cookies.get(COOKIE[dialecto]) != cookie:
+            return False
+        if expires is not None and time.monotonic() > expires:
+            del state["sessions"][csrf]
+            _count("expired")
+            return False
+        return True
+
+    async def _stamgr(request: Request, site: str, dialecto: str):
+        if not _dialect_ok(dialecto):
+            return JSONResponse({"error": "not found"}, status_code=404)
+        await _delay()
+        fault = await _faults()
+        if fault is not None:
+            return fault
+
+        state["commands"] += 1
+        if sim["expire_every"] and state["commands"] % sim["expire_every"] == 0:
+            state["sessions"].clear()
+            _count("expired")
+
+        if not _session_valid(request, dialecto):
+            _count("rejected")
+            return _login_required()
+
+        body = await request.json()
+        cmd = body.get("cmd")
+        if cmd not in ("authorize-guest", "unauthorize-guest"):
+            return JSONResponse({"meta": {"rc": "error", "msg": "api.err.UnknownCommand"}}, status_code=400)
+        if not body.get("mac"):
+            return JSONResponse({"meta": {"rc": "error", "msg": "api.err.InvalidMac"}}, status_code=400)
+        _count(cmd)
+        return JSONResponse({"meta": {"rc": "ok"}, "data": [{"mac": body["mac"], "site": site}]})
+
+    async def login_unifi_os(request: Request):
+        return await _login(request, "unifi_os")
+
+    async def login_classic(request: Request):
+        return await _login(request, "classic")
+
+    async def stamgr_unifi_os(request: Request, site: str):
+        return await _stamgr(request, site, "unifi_os")
+
+    async def stamgr_classic(request: Request, site: str):
+        return await _stamgr(request, site, "classic")
+
+    app.add_api_route("/api/auth/login", login_unifi_os, methods=["POST"])
+    app.add_api_route("/api/login", login_classic, methods=["POST"])
+    app.add_api_route("/proxy/network/api/s/{site}/cmd/stamgr", stamgr_unifi_os, methods=["POST"])
+    app.add_api_route("/api/s/{site}/cmd/stamgr", stamgr_classic, methods=["POST"])
+
+    # ---------- control del simulador ----------
+    @app.get("/_sim/stats")
+    async def sim_stats():
+        return {**state["counters"], "sessions": len(state["sessions"]), "commands": state["commands"]}
+
+    @app.get("/_sim/config")
+    async def sim_config():
+        return {k: v for k, v in sim.items() if k != "password"}
+
+    @app.post("/_sim/config")
+    async def sim_update(request: Request):
+        changes = await request.json()
+        unknown = set(changes) - set(DEFAULTS)
+        if unknown:
+            return JSONResponse({"error": f"opciones desconocidas: {sorted(unknown)}"}, status_code=400)
+        sim.update(changes)
+        if "seed" in changes:
+            state["rng"].seed(changes["seed"])
+        return await sim_config()
+
+    @app.post("/_sim/reset")
+    async def sim_reset():
+        """Borra sesiones (fuerza re-login) y contadores."""
+        state["sessions"].clear()
+        state["commands"] = 0
+        state["counters"] = dict.fromkeys(COUNTERS, 0)
+        return {"ok": True}
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app: FastAPI, host="127.0.0.1", port=0):
+    """Levanta el simulador con uvicorn en un thread; devuelve (url, server)."""
+    import uvicorn
+
+    port = port or _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("El simulador de controlador no arrancó")
+        time.sleep(0.02)
+    return f"http://{host}:{port}", server
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Simulador de controlador UniFi (modelos 2/3/4)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--modelo", type=int, choices=(2, 3, 4), help="solo ese dialecto (default: todos)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--hang-s", type=float, default=30.0)
+    parser.add_argument("--session-ttl", type=float, default=0.0)
+    parser.add_argument("--expire-every", type=int, default=0)
+    parser.add_argument("--login-fail-rate", type=float, default=0.0)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--certfile", help="servir por HTTPS (como el hardware real)")
+    parser.add_argument("--keyfile")
+    args = vars(parser.parse_args())
+
+    host, port = args.pop("host"), args.pop("port")
+    certfile, keyfile = args.pop("certfile"), args.pop("keyfile")
+    uvicorn.run(
+        create_app(**args),
+        host=host,
+        port=port,
+        log_level="warning",
+        ssl_certfile=certfile,
+        ssl_keyfile=keyfile,
+    )
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timedelta
+
+
+# ------------------------------------------------------
+# POOL ASYNCPG EN MEMORIA (lo justo que usa el portal)
+# ------------------------------------------------------
+# Guarda las filas de la tabla de signups en una lista; cada operación
+# espera `latency_ms` para simular el viaje a Postgres. Los filtros del
+# panel admin no se evalúan: se devuelven las filas más nuevas.
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    async def _delay(self):
+        if self.db.latency:
+            await asyncio.sleep(self.db.latency)
+
+    async def execute(self, sql, *args):
+        await self._delay()
+        if sql.lstrip().upper().startswith("INSERT"):
+            self.db.insert([*args, datetime.now()])
+        return "OK"
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        await self._delay()
+        for record in records:
+            self.db.insert(list(record))
+        return f"COPY {len(records)}"
+
+    async def fetch(self, sql, *args):
+        await self._delay()
+        if "unnest" in sql and args:
+            return [(ts.astimezone().replace(tzinfo=None),) for ts in args[0]]
+        if "LIMIT" in sql and args:
+            limit = args[-1]
+            return list(reversed(self.db.rows[-limit:]))
+        return []
+
+    def transaction(self):
+        return _NullContext()
+
+    def cursor(self, query, *args, prefetch=None):
+        return _RowIterator(self.db, prefetch or 100)
+
+
+class _NullContext:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _RowIterator:
+    """Cursor DESC por id, con un 'viaje' a la DB cada `prefetch` filas."""
+
+    def __init__(self, db, prefetch):
+        self.db = db
+        self.prefetch = prefetch
+        self.rows = list(reversed(self.db.rows))
+        self.i = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.i >= len(self.rows):
+            raise StopAsyncIteration
+        if self.i % self.prefetch == 0 and self.db.latency:
+            await asyncio.sleep(self.db.latency)
+        row = self.rows[self.i]
+        self.i += 1
+        return row
+
+
+class _Acquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        await self.pool._sem.acquire()
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *exc):
+        self.pool._sem.release()
+        return False
+
+
+class FakePool:
+    def __init__(self, latency_ms=1.0, max_size=5, seed_rows=0):
+        self.latency = latency_ms / 1000
+        self.max_size = max_size
+        self._sem = asyncio.Semaphore(max_size)
+        self.rows: list[tuple] = []
+        self._next_id = 1
+        self.seed(seed_rows)
+
+    def insert(self, values):
+        # values: fullname, email, phone, client_mac, client_ip, ap_mac, created_at
+        self.rows.append((self._next_id, *values))
+        self._next_id += 1
+
+    def seed(self, n):
+        start = datetime.now() - timedelta(days=7)
+        for i in range(n):
+            self.insert([
+                f"Guest {i}",
+                f"guest{i}@example.com",
+                "",
+                f"02:00:00:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}",
+                "10.0.0.10",
+                "00:11:22:33:44:55",
+                start + timedelta(seconds=i * 30),
+            ])
+
+    def acquire(self, timeout=None):
+        return _Acquire(self)
+
+    def get_size(self):
+        return self.max_size
+
+    def get_idle_size(self):
+        return self._sem._value
+
+    async def close(self):
+        pass
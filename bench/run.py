@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import configparser
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from bench.fake_controller import create_app, serve_in_thread  # noqa: E402
+from bench.fake_db import FakePool  # noqa: E402
+from services.dispatcher import _percentil  # noqa: E402
+
+SCENARIOS = ("get", "post", "admin", "export")
+RESULTS_DIR = os.path.join(BASE_DIR, "bench", "results")
+
+
+# ------------------------------------------------------
+# ESCENARIOS (una request cada uno; True = respuesta esperada)
+# ------------------------------------------------------
+def _mac(i: int) -> str:
+    return "02:be:%02x:%02x:%02x:%02x" % (i >> 24 & 255, i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+def _ip(i: int) -> str:
+    # un guest = una IP (el limitador de POST / va por MAC y por IP)
+    return "10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+async def scenario_get(client, i):
+    r = await client.get("/", params={"lang": "es"})
+    return r.status_code == 200
+
+
+async def scenario_post(client, i):
+    r = await client.post(
+        "/",
+        params={"id": _mac(i), "ap": "00:11:22:33:44:55", "ssid": "bench"},
+        data={"fullname": f"Bench {i}", "email": f"bench{i}@example.com", "phone": ""},
+        headers={"x-real-ip": _ip(i)},
+    )
+    return r.status_code == 302 and "status=success" in r.headers.get("location", "")
+
+
+async def scenario_admin(client, i):
+    r = await client.get("/admin")
+    return r.status_code == 200
+
+
+async def scenario_export(client, i):
+    r = await client.get("/admin/export")
+    return r.status_code == 200 and len(r.content) > 0
+
+
+RUNNERS = {
+    "get": scenario_get,
+    "post": scenario_post,
+    "admin": scenario_admin,
+    "export": scenario_export,
+}
+
+
+# ------------------------------------------------------
+# MEDICIÓN
+# ------------------------------------------------------
+async def run_scenario(client, name, total, concurrency, warmup, offset):
+    fn = RUNNERS[name]
+    for i in range(warmup):
+        await fn(client, offset + i)
+
+    latencies: list[float] = []
+    errors = 0
+    ids = itertools.count(offset + warmup)
+    done = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(done) < total:
+            i = next(ids)
+            t0 = time.perf_counter()
+            try:
+                ok = await fn(client, i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - t0)
+            if not ok:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentil(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentil(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentil(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+# ------------------------------------------------------
+# ENTORNO: portal en proceso con DB / controlador falsos
+# ------------------------------------------------------
+async def setup_inprocess(args):
+    """
+    Importa el portal y lo conecta a los stand-ins: controlador falso por
+    HTTP local (todas las rutas apuntan a él) y, con --db fake, un pool
+    asyncpg en memoria. Con --db postgres usa la DB de DB_HOST/DB_* (¡debe
+    ser descartable: el export con cleanup borra filas!).
+    """
+    import database
+    import main
+    from services import routing
+    from services.metrics import TimedPool
+    from services.signup_buffer import signup_buffer, WRITE_BEHIND
+
+    sim_app = create_app(
+        modelo=args.modelo,
+        latency_ms=args.controller_latency_ms,
+        jitter_ms=args.controller_jitter_ms,
+        error_rate=args.controller_error_rate,
+        timeout_rate=args.controller_timeout_rate,
+        session_ttl=args.controller_session_ttl,
+        expire_every=args.controller_expire_every,
+        seed=args.seed,
+    )
+    ctrl_url, server = serve_in_thread(sim_app)
+
+    def _to_sim(route):
+        route = route._replace(ctrl=ctrl_url)
+        return route._replace(modelo=args.modelo) if args.modelo else route
+
+    routing.DEFAULT_ROUTE = _to_sim(routing.DEFAULT_ROUTE)
+    for ap, route in list(routing.ROUTES.items()):
+        routing.ROUTES[ap] = _to_sim(route)
+
+    if args.db == "fake":
+        # Sin Postgres: el contador no se re-sincroniza ni dispara exports, y
+        # /admin/export va por streaming (el modo cleanup necesita psycopg2)
+        database._record_count = 0
+        database._last_reconcile = time.monotonic()
+        database.COUNT_RECONCILE_INTERVAL = float("inf")
+        database.MAX_RECORDS = 10 ** 12
+        main.CLEANUP_ON_EXPORT = False
+
+        pool = TimedPool(FakePool(args.db_latency_ms, args.pool_size, args.seed_rows))
+        main.db_pool = pool
+        if WRITE_BEHIND:
+            signup_buffer.spool_dir = tempfile.mkdtemp(prefix="bench-spool-")
+            await signup_buffer.start(pool)
+    else:
+        await main.startup_event()
+
+    async def teardown():
+        info["controller_stats"] = await _sim_stats(ctrl_url)
+        if args.db == "postgres":
+            await main.shutdown_event()
+        else:
+            await _fake_shutdown(signup_buffer)
+        server.should_exit = True
+
+    # el bench entra como nginx (proxy de confianza): la IP de cada huésped va en X-Real-IP
+    client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000)),
+        base_url="http://portal",
+        timeout=args.timeout,
+    )
+    info = {"portal_version": main.actualver, "controller": ctrl_url}
+    return client, teardown, info
+
+
+async def _sim_stats(ctrl_url):
+    """Contadores del simulador (logins, 401, errores…) para el reporte."""
+    try:
+        async with httpx.AsyncClient(base_url=ctrl_url, timeout=5) as c:
+            return (await c.get("/_sim/stats")).json()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def _fake_shutdown(signup_buffer):
+    from services.unifi_async import close_controllers
+
+    await close_controllers()
+    if signup_buffer.running:
+        await signup_buffer.stop()
+
+
+async def login(client, user, password):
+    r = await client.post("/login", data={"username": user, "password": password})
+    if r.status_code != 302:
+        raise RuntimeError(f"Login admin falló ({r.status_code}); revisar --admin-user / --admin-pass")
+
+
+# ------------------------------------------------------
+# COMPARACIÓN CONTRA UNA CORRIDA ANTERIOR
+# ------------------------------------------------------
+def compare(results, baseline_path, tolerance):
+    """Lista de regresiones: p95 más alto o throughput más bajo que la base (± tolerancia)."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["scenarios"]
+
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} → {cur['p95_ms']} ms")
+        if cur["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['rps']} → {cur['rps']} req/s")
+        if cur["errors"] > base["errors"]:
+            regressions.append(f"{name}: errores {base['errors']} → {cur['errors']}")
+    return regressions
+
+
+def print_table(results):
+    cols = ("requests", "concurrency", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print(f"{'scenario':<10}" + "".join(f"{c:>13}" for c in cols))
+    for name, r in results.items():
+        print(f"{name:<10}" + "".join(f"{r[c]:>13}" for c in cols))
+
+
+# ------------------------------------------------------
+# MAIN
+# ------------------------------------------------------
+def parse_args(argv=None):
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(os.path.join(BASE_DIR, "config.ini"))
+    admin = config["Admin"] if config.has_section("Admin") else {}
+
+    p = argparse.ArgumentParser(description="Benchmark de endpoints del portal")
+    p.add_argument("--scenarios", default=",".join(SCENARIOS),
+                   help="lista separada por comas: " + ",".join(SCENARIOS))
+    p.add_argument("--requests", type=int, default=500, help="requests por escenario")
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--warmup", type=int, default=20, help="requests previas no medidas")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--url", help="portal ya levantado (no se usan stand-ins en proceso)")
+    p.add_argument("--db", choices=("fake", "postgres"), default="fake")
+    p.add_argument("--db-latency-ms", type=float, default=1.0)
+    p.add_argument("--pool-size", type=int, default=5)
+    p.add_argument("--seed-rows", type=int, default=2000, help="filas iniciales de la DB falsa")
+    p.add_argument("--modelo", type=int, choices=(2, 3, 4),
+                   help="dialecto del controlador simulado (default: el de config.ini)")
+    p.add_argument("--controller-latency-ms", type=float, default=20.0)
+    p.add_argument("--controller-jitter-ms", type=float, default=0.0)
+    p.add_argument("--controller-error-rate", type=float, default=0.0, help="fracción de respuestas 500")
+    p.add_argument("--controller-timeout-rate", type=float, default=0.0, help="fracción de requests colgadas")
+    p.add_argument("--controller-session-ttl", type=float, default=0.0, help="segundos hasta el 401 (0 = no vence)")
+    p.add_argument("--controller-expire-every", type=int, default=0, help="401 forzado cada N comandos")
+    p.add_argument("--seed", type=int, help="semilla de las fallas inyectadas")
+    p.add_argument("--admin-user", default=admin.get("username", "admin"))
+    p.add_argument("--admin-pass", default=admin.get("password", ""))
+    p.add_argument("--quiet", action="store_true", help="solo WARNING/ERROR en los logs del portal")
+    p.add_argument("--out", help="JSON de resultados (default bench/results/bench-<fecha>.json)")
+    p.add_argument("--compare", help="JSON de una corrida anterior; sale con 1 si hay regresión")
+    p.add_argument("--tolerance", type=float, default=0.2, help="margen para --compare (0.2 = 20%%)")
+    return p.parse_args(argv)
+
+
+async def main_async(args):
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [n for n in names if n not in RUNNERS]
+    if unknown:
+        raise SystemExit(f"Escenarios desconocidos: {', '.join(unknown)}")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, verify=False, timeout=args.timeout)
+        teardown, info = None, {"url": args.url}
+    else:
+        client, teardown, info = await setup_inprocess(args)
+        if args.quiet:
+            # después de importar el portal (setup_logging fija INFO)
+            logging.getLogger("portal").setLevel(logging.WARNING)
+
+    results = {}
+    try:
+        if {"admin", "export"} & set(names):
+            await login(client, args.admin_user, args.admin_pass)
+        for n, name in enumerate(names):
+            print(f"▶ {name}: {args.requests} requests, concurrencia {args.concurrency}", flush=True)
+            results[name] = await run_scenario(
+                client, name, args.requests, args.concurrency, args.warmup, offset=n * 10 ** 6
+            )
+    finally:
+        await client.aclose()
+        if teardown:
+            await teardown()
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": "url" if args.url else f"inprocess/{args.db}",
+        "params": {
+            k: getattr(args, k)
+            for k in ("requests", "concurrency", "warmup", "db_latency_ms", "pool_size",
+                      "seed_rows", "modelo", "controller_latency_ms", "controller_jitter_ms",
+                      "controller_error_rate", "controller_timeout_rate",
+                      "controller_session_ttl", "controller_expire_every", "seed")
+        },
+        **info,
+        "scenarios": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(main_async(args))
+
+    print()
+    print_table(report["scenarios"])
+
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"bench-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n🟢 Resultados → {out}")
+
+    if args.compare:
+        regressions = compare(report["scenarios"], args.compare, args.tolerance)
+        if regressions:
+            print("🔴 Regresiones contra", args.compare)
+            for line in regressions:
+                print("  -", line)
+            return 1
+        print("🟢 Sin regresiones contra", args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,21 @@
 import os
+import time
+import asyncio
+import threading
+import asyncpg
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 import csv
+import json
+import hashlib
 from io import StringIO
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import configparser
 
+from services.metrics import DB_ACQUIRE_SECONDS, EXPORT_SECONDS, EXPORTS, TimedPool
+
 # ------------------------------------------------------
 # 📌 CARGAR CONFIG (sin interpolación)
 # ------------------------------------------------------
@@ -16,6 +27,8 @@ config.read(CONFIG_PATH)
 
 MAX_RECORDS = int(config["Database"].get("max_records", "500"))
 CLEANUP_ON_EXPORT = config["Database"].get("cleanup_on_export", "yes").lower() == "yes"
+# Cada cuánto (segundos) el contador incremental se re-sincroniza con COUNT(*)
+COUNT_RECONCILE_INTERVAL = int(config["Database"].get("count_reconcile_interval", "300"))
 import re
 
 RAW_TABLE_NAME = config["Database"].get("table_name", "signups")
@@ -36,6 +49,14 @@ SEPARADOR_ALTERNATIVO = (
 )
 
 CSV_DELIMITER = ";" if SEPARADOR_ALTERNATIVO else ","
+# watermark → exporta/borra hasta MAX(id) sin bloquear inserts | lock → LOCK TABLE (modo viejo)
+EXPORT_MODE = config["Export"].get("export_mode", "watermark").strip().lower()
+# Clave del advisory lock que evita dos exports a la vez
+EXPORT_LOCK_KEY = 727001
+CSV_HEADER = ["ID", "Nombre", "Email", "Teléfono", "MAC", "IP", "AP MAC", "Fecha"]
+# Tamaño aprox. de cada chunk del export en streaming (y filas por fetch del cursor)
+STREAM_CHUNK_BYTES = 64 * 1024
+STREAM_FETCH_ROWS = 1000
 
 # Ruta final donde guardar CSV
 if ABSOLUTE_PATH:
@@ -46,147 +67,499 @@ else:
 os.makedirs(FINAL_EXPORT_DIR, exist_ok=True)
 
 # ------------------------------------------------------
-# 🔌 CONEXIÓN A POSTGRES
+# 🔌 CONEXIÓN A POSTGRES (pools compartidos)
 # ------------------------------------------------------
-def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "db"),
-        port=os.getenv("DB_PORT", "5432"),
-        user=os.getenv("DB_USER", "portal"),
-        password=os.getenv("DB_PASS", "portal123"),
-        dbname=os.getenv("DB_NAME", "captive_portal")
+# Un pool por proceso/worker para cada driver:
+#   asyncpg  → handlers async de main.py (POST /, admin, export en streaming)
+#   psycopg2 → código sync: to_thread, export en background y CLI (services/exporter.py)
+POOL_MIN_SIZE = int(config["Database"].get("pool_min_size", "1"))
+POOL_MAX_SIZE = int(config["Database"].get("pool_max_size", "10"))
+SYNC_POOL_MAX_SIZE = int(config["Database"].get("sync_pool_max_size", "5"))
+# Tope de conexiones de TODOS los workers juntos (debajo de max_connections de Postgres, 100
+# por defecto). Con WEB_CONCURRENCY workers cada uno usa su parte: un tercio para psycopg2
+WEB_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_MAX_CONNECTIONS = int(config["Database"].get("max_connections", "80"))
+_worker_budget = max(2, DB_MAX_CONNECTIONS // WEB_WORKERS)
+SYNC_POOL_MAX_SIZE = max(1, min(SYNC_POOL_MAX_SIZE, _worker_budget // 3))
+POOL_MAX_SIZE = max(1, min(POOL_MAX_SIZE, _worker_budget - SYNC_POOL_MAX_SIZE))
+POOL_MIN_SIZE = min(POOL_MIN_SIZE, POOL_MAX_SIZE)
+# Segundos esperando una conexión libre antes de fallar
+POOL_ACQUIRE_TIMEOUT = float(config["Database"].get("pool_acquire_timeout", "10"))
+
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "db"),
+    "port": int(os.getenv("DB_PORT", "5432")),
+    "user": os.getenv("DB_USER", "portal"),
+    "password": os.getenv("DB_PASS", "portal123"),
+    "dbname": os.getenv("DB_NAME", "captive_portal"),
+}
+
+_sync_pool: ThreadedConnectionPool | None = None
+_sync_pool_lock = threading.Lock()
+# ThreadedConnectionPool tira PoolError si se agota; el semáforo hace esperar
+_sync_slots = threading.BoundedSemaphore(SYNC_POOL_MAX_SIZE)
+
+
+def _get_sync_pool() -> ThreadedConnectionPool:
+    global _sync_pool
+    if _sync_pool is None:
+        with _sync_pool_lock:
+            if _sync_pool is None:
+                _sync_pool = ThreadedConnectionPool(
+                    min(POOL_MIN_SIZE, SYNC_POOL_MAX_SIZE), SYNC_POOL_MAX_SIZE, **DB_PARAMS
+                )
+    return _sync_pool
+
+
+@contextmanager
+def db_connection():
+    """
+    Conexión psycopg2 prestada del pool. Al devolverla se hace rollback de
+    lo que haya quedado sin commit; si se rompió (Postgres reiniciado, etc.)
+    se descarta en vez de volver al pool.
+    """
+    if not _sync_slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT):
+        raise PoolError(f"Sin conexiones libres después de {POOL_ACQUIRE_TIMEOUT}s")
+    t0 = time.perf_counter()
+    conn = None
+    try:
+        pool = _get_sync_pool()
+        conn = pool.getconn()
+        DB_ACQUIRE_SECONDS.observe(time.perf_counter() - t0, "psycopg2")
+        yield conn
+    finally:
+        try:
+            if conn is not None:
+                broken = bool(conn.closed)
+                if not broken and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
+                pool.putconn(conn, close=broken)
+        finally:
+            _sync_slots.release()
+
+
+async def open_async_pool():
+    """Pool asyncpg de los handlers (tamaños de [Database]); mide la espera de acquire."""
+    pool = await asyncpg.create_pool(
+        host=DB_PARAMS["host"],
+        port=DB_PARAMS["port"],
+        user=DB_PARAMS["user"],
+        password=DB_PARAMS["password"],
+        database=DB_PARAMS["dbname"],
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
     )
+    return TimedPool(pool, timeout=POOL_ACQUIRE_TIMEOUT)
+
+
+def close_sync_pool():
+    global _sync_pool
+    with _sync_pool_lock:
+        if _sync_pool is not None:
+            _sync_pool.closeall()
+            _sync_pool = None
 
 # ------------------------------------------------------
-# 🧱 CREAR DB Y TABLA
+# 📊 ROLLUPS (signups por hora/AP y MACs únicas por día)
 # ------------------------------------------------------
-def db_init():
-    """Crea la base y tabla si no existen."""
-    try:
-        sys_conn = psycopg2.connect(
-            host=os.getenv("DB_HOST", "db"),
-            port=os.getenv("DB_PORT", "5432"),
-            user=os.getenv("POSTGRES_USER", os.getenv("DB_USER", "portal")),
-            password=os.getenv("POSTGRES_PASSWORD", os.getenv("DB_PASS", "portal123")),
-            dbname="postgres"
-        )
-        sys_conn.autocommit = True
-        cur = sys_conn.cursor()
-        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s",
-                    (os.getenv("DB_NAME", "captive_portal"),))
-        if not cur.fetchone():
-            cur.execute(f"CREATE DATABASE {os.getenv('DB_NAME', 'captive_portal')}")
-            print("🟢 Base de datos creada.")
-        cur.close()
-        sys_conn.close()
-    except Exception as e:
-        print(f"⚠️ Error creando/verificando DB: {e}")
+# Se actualizan con un trigger por sentencia sobre las visitas (sirve igual
+# para INSERT y COPY) y no dependen de las filas crudas: sobreviven al DELETE
+# del export.
+# El DDL (tablas + trigger) está en services/migrate.py.
+HOURLY_TABLE = f"{TABLE_NAME}_hourly"
+DAILY_MACS_TABLE = f"{TABLE_NAME}_daily_macs"
+
+# ------------------------------------------------------
+# 👤 HUÉSPEDES (identidad única) + VISITAS
+# ------------------------------------------------------
+# Desde la migración 4, {TABLE_NAME} es una vista sobre visitas ⨝ huéspedes.
+# Un trigger INSTEAD OF hace el upsert: el huésped por email, el dispositivo
+# por MAC (visit_count, last_seen) y una fila chica en visitas. Los que
+# escriben (INSERT, COPY del buffer) y leen (admin, export) no cambian.
+GUESTS_TABLE = f"{TABLE_NAME}_guests"
+DEVICES_TABLE = f"{TABLE_NAME}_devices"
+VISITS_TABLE = f"{TABLE_NAME}_visits"
+LEGACY_TABLE = f"{TABLE_NAME}_legacy"
+
+# Autorizaciones pendientes en el controlador (services/auth_outbox.py)
+OUTBOX_TABLE = f"{TABLE_NAME}_auth_outbox"
 
-    # Crear tabla principal
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-                id SERIAL PRIMARY KEY,
-                fullname VARCHAR(200),
-                email VARCHAR(200),
-                phone VARCHAR(50),
-                client_mac VARCHAR(50),
-                client_ip VARCHAR(50),
-                ap_mac VARCHAR(50),
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        """)
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"🟢 Tabla '{TABLE_NAME}' OK.")
-    except Exception as e:
-        print(f"⚠️ Error creando tabla '{TABLE_NAME}': {e}")
 
 # ------------------------------------------------------
 # 📥 OBTENER TODOS LOS REGISTROS
 # ------------------------------------------------------
 def db_get_all():
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC")
-        rows = cur.fetchall()
-    except psycopg2.errors.UndefinedTable:
-        conn.rollback()
-        db_init()
-        cur.execute(f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC")
-        rows = cur.fetchall()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC")
+            rows = cur.fetchall()
+        except psycopg2.errors.UndefinedTable:
+            # esquema sin migrar (python -m services.migrate)
+            conn.rollback()
+            rows = []
+        finally:
+            cur.close()
     return rows
 
+# ------------------------------------------------------
+# 📄 PÁGINA DE REGISTROS (keyset sobre id + filtros)
+# ------------------------------------------------------
+def _page_query(filters, before=None, after=None, limit=50, placeholder="%s"):
+    """
+    Arma el SELECT de una página. filters: email (prefijo), client_mac, ap_mac,
+    date_from / date_to (date). before/after: id de corte para la página
+    siguiente / anterior. Devuelve (sql, params); la query trae limit + 1
+    filas para saber si hay más.
+    """
+    where, params = [], []
+
+    def ph(value):
+        params.append(value)
+        return placeholder.replace("{n}", str(len(params)))
+
+    if filters.get("email"):
+        prefix = filters["email"].lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append(f"lower(email) LIKE {ph(prefix + '%')}")
+    if filters.get("client_mac"):
+        where.append(f"lower(client_mac) = {ph(filters['client_mac'].lower())}")
+    if filters.get("ap_mac"):
+        where.append(f"lower(ap_mac) = {ph(filters['ap_mac'].lower())}")
+    if filters.get("date_from"):
+        where.append(f"created_at >= {ph(datetime.combine(filters['date_from'], datetime.min.time()))}")
+    if filters.get("date_to"):
+        date_to = datetime.combine(filters["date_to"], datetime.min.time()) + timedelta(days=1)
+        where.append(f"created_at < {ph(date_to)}")
+
+    if after is not None:
+        where.append(f"id > {ph(after)}")
+        order = "ASC"
+    else:
+        if before is not None:
+            where.append(f"id < {ph(before)}")
+        order = "DESC"
+
+    sql = f"SELECT * FROM {TABLE_NAME}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY id {order} LIMIT {ph(limit + 1)}"
+    return sql, params
+
+
+def _page_result(rows, before, after, limit):
+    has_more = len(rows) > limit
+    rows = [tuple(r) for r in rows[:limit]]
+    if after is not None:
+        # se pidió en ASC para ir "hacia atrás": se da vuelta para mostrar DESC
+        rows.reverse()
+        return {"rows": rows, "has_newer": has_more, "has_older": True}
+    return {"rows": rows, "has_newer": before is not None, "has_older": has_more}
+
+
+def db_get_page(filters, before=None, after=None, limit=50):
+    sql, params = _page_query(filters, before, after, limit)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    return _page_result(rows, before, after, limit)
+
+
+async def db_get_page_async(pool, filters, before=None, after=None, limit=50):
+    sql, params = _page_query(filters, before, after, limit, placeholder="${n}")
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(sql, *params)
+    return _page_result(rows, before, after, limit)
+
+# ------------------------------------------------------
+# 👤 HUÉSPED QUE VUELVE (MAC registrada hace poco)
+# ------------------------------------------------------
+# Lookup por PK en DEVICES_TABLE; la ventana se evalúa en la DB (NOW() del server)
+# revoked_at: revocado desde el admin; un registro nuevo (last_seen posterior) lo habilita otra vez
+RETURNING_DEVICE_SQL = (
+    f"SELECT 1 FROM {DEVICES_TABLE} "
+    f"WHERE client_mac = {{mac}} AND last_seen >= NOW() - {{days}} * interval '1 day' "
+    f"AND (revoked_at IS NULL OR revoked_at < last_seen)"
+)
+REVOKE_DEVICE_SQL = f"UPDATE {DEVICES_TABLE} SET revoked_at = NOW() WHERE client_mac = {{mac}}"
+# En la misma transacción: que el outbox no vuelva a autorizar lo que se acaba de revocar
+CANCEL_OUTBOX_SQL = (
+    f"UPDATE {OUTBOX_TABLE} SET status = 'cancelled', last_error = 'revocada desde el admin', "
+    f"updated_at = NOW() WHERE lower(client_mac) = {{mac}} AND status = 'pending'"
+)
+
+
+def db_is_returning_device(mac: str, days: float) -> bool:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(RETURNING_DEVICE_SQL.format(mac="%s", days="%s"), (mac.lower(), days))
+            return cur.fetchone() is not None
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            return False
+        finally:
+            cur.close()
+
+
+async def db_is_returning_device_async(pool, mac: str, days: float) -> bool:
+    async with pool.acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                RETURNING_DEVICE_SQL.format(mac="$1", days="$2::float8"), mac.lower(), days
+            )
+        except asyncpg.exceptions.UndefinedTableError:
+            return False
+    return row is not None
+
+
+def db_revoke_device(mac: str) -> bool:
+    """
+    Marca la MAC como revocada (el próximo GET / vuelve a pedir el formulario)
+    y cancela su autorización pendiente en el outbox.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(REVOKE_DEVICE_SQL.format(mac="%s"), (mac.lower(),))
+            revoked = cur.rowcount > 0
+            cur.execute(CANCEL_OUTBOX_SQL.format(mac="%s"), (mac.lower(),))
+            conn.commit()
+            return revoked
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+async def db_revoke_device_async(pool, mac: str) -> bool:
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            status = await conn.execute(REVOKE_DEVICE_SQL.format(mac="$1"), mac.lower())
+            await conn.execute(CANCEL_OUTBOX_SQL.format(mac="$1"), mac.lower())
+    return int(status.split()[-1]) > 0
+
+# ------------------------------------------------------
+# 📊 ESTADÍSTICAS (solo lee rollups)
+# ------------------------------------------------------
+STATS_QUERIES = {
+    "hourly": f"""
+        SELECT hour, SUM(signups) AS signups FROM {HOURLY_TABLE}
+        WHERE hour >= date_trunc('hour', NOW()) - make_interval(hours => {{hours}})
+        GROUP BY hour ORDER BY hour DESC
+    """,
+    "per_ap": f"""
+        SELECT ap_mac, SUM(signups) AS signups FROM {HOURLY_TABLE}
+        WHERE hour >= date_trunc('day', NOW()) - make_interval(days => {{days}})
+        GROUP BY ap_mac ORDER BY signups DESC
+    """,
+    "unique_macs": f"""
+        SELECT day, COUNT(*) AS macs FROM {DAILY_MACS_TABLE}
+        WHERE day >= CURRENT_DATE - {{days}}
+        GROUP BY day ORDER BY day DESC
+    """,
+}
+
+
+def _stats_sql(name, placeholder):
+    # días / horas van como parámetro; el placeholder depende del driver
+    return STATS_QUERIES[name].format(hours=placeholder, days=placeholder)
+
+
+def db_get_stats(days=7):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            out = {}
+            cur.execute(_stats_sql("hourly", "%s"), (days * 24,))
+            out["hourly"] = cur.fetchall()
+            cur.execute(_stats_sql("per_ap", "%s"), (days,))
+            out["per_ap"] = cur.fetchall()
+            cur.execute(_stats_sql("unique_macs", "%s"), (days,))
+            out["unique_macs"] = cur.fetchall()
+        finally:
+            cur.close()
+    return out
+
+
+async def db_get_stats_async(pool, days=7):
+    async with pool.acquire() as conn:
+        return {
+            "hourly": [tuple(r) for r in await conn.fetch(_stats_sql("hourly", "$1::int"), days * 24)],
+            "per_ap": [tuple(r) for r in await conn.fetch(_stats_sql("per_ap", "$1::int"), days)],
+            "unique_macs": [tuple(r) for r in await conn.fetch(_stats_sql("unique_macs", "$1::int"), days)],
+        }
+
 # ------------------------------------------------------
 # 🔢 CONTAR REGISTROS
 # ------------------------------------------------------
 def count_records():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
-    total = cur.fetchone()[0]
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
+        total = cur.fetchone()[0]
+        cur.close()
     return total
 
 # ------------------------------------------------------
-# ✍️ INSERTAR REGISTRO Y CHEQUEAR EXPORT
+# 🔢 CONTADOR INCREMENTAL + EXPORT EN BACKGROUND
 # ------------------------------------------------------
-def db_insert_signup(data):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        INSERT INTO {TABLE_NAME} (fullname, email, phone, client_mac, client_ip, ap_mac)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (
-        data["fullname"],
-        data["email"],
-        data.get("phone", ""),
-        data.get("client_mac", ""),
-        data.get("client_ip", ""),
-        data.get("ap_mac", "")
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    # export automático
+_count_lock = threading.Lock()
+_record_count = None
+
+_export_lock = threading.Lock()
+_last_export_fail = 0.0
+EXPORT_RETRY_SECONDS = 60
+
+
+def reconcile_record_count():
+    """Re-sincroniza el contador en memoria con la tabla."""
+    global _record_count
     total = count_records()
+    with _count_lock:
+        _record_count = total
+    return total
+
+
+def track_inserts(n=1):
+    """
+    Suma n filas al contador (sin COUNT(*) por insert) y, si se llegó a
+    MAX_RECORDS, dispara el export automático en background. Nunca cuenta la
+    tabla: eso lo hace run_count_reconcile() fuera de los requests; mientras
+    el contador no está inicializado devuelve None.
+    """
+    global _record_count
+    with _count_lock:
+        if _record_count is None:
+            return None
+        _record_count += n
+        total = _record_count
+
     if total >= MAX_RECORDS:
-        print(f"📦 Límite de {MAX_RECORDS} registros → Export autom.")
-        auto_export_and_cleanup()
+        export_in_background()
+    return total
+
+
+async def run_count_reconcile(interval=COUNT_RECONCILE_INTERVAL):
+    """Tarea de fondo: re-sincroniza el contador cada `interval` segundos."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            total = await asyncio.to_thread(reconcile_record_count)
+        except Exception as e:
+            print(f"⚠️ No se pudo contar registros: {e}")
+            continue
+        if total >= MAX_RECORDS:
+            export_in_background()
+
+
+def export_in_background():
+    """Lanza auto_export_and_cleanup en un thread; si ya hay uno corriendo no hace nada."""
+    global _last_export_fail
+    if time.monotonic() - _last_export_fail < EXPORT_RETRY_SECONDS:
+        return False
+    if not _export_lock.acquire(blocking=False):
+        return False
+
+    def _job():
+        global _last_export_fail
+        try:
+            print(f"📦 Límite de {MAX_RECORDS} registros → Export autom.")
+            if not auto_export_and_cleanup():
+                _last_export_fail = time.monotonic()
+        finally:
+            try:
+                reconcile_record_count()
+            except Exception as e:
+                print(f"⚠️ No se pudo contar registros: {e}")
+            _export_lock.release()
+
+    threading.Thread(target=_job, name="auto-export", daemon=True).start()
+    return True
 
 # ------------------------------------------------------
-# 📝 LOG DE ERRORES
+# ✍️ INSERTAR REGISTRO Y CHEQUEAR EXPORT
 # ------------------------------------------------------
-def log_db_error(msg):
-    """Guarda un error en tabla 'errors'."""
-    try:
-        conn = get_connection()
+# Largo de cada columna (VARCHAR en services/migrate.py): lo que viene del
+# formulario o de la query (?id=, ?ap=) se recorta antes de llegar a la DB
+SIGNUP_FIELD_LIMITS = {
+    "fullname": 200,
+    "email": 200,
+    "phone": 50,
+    "client_mac": 50,
+    "client_ip": 50,
+    "ap_mac": 50,
+}
+
+
+def clean_signup(data: dict) -> dict:
+    """Copia del signup que la tabla acepta: sin bytes NUL y recortada al largo de cada columna."""
+    clean = dict(data)
+    for field, limit in SIGNUP_FIELD_LIMITS.items():
+        clean[field] = str(clean.get(field) or "").replace("\x00", "")[:limit]
+    return clean
+
+
+def db_insert_signup(data):
+    with db_connection() as conn:
         cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO {TABLE_NAME} (fullname, email, phone, client_mac, client_ip, ap_mac)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (
+            data["fullname"],
+            data["email"],
+            data.get("phone", ""),
+            data.get("client_mac", ""),
+            data.get("client_ip", ""),
+            data.get("ap_mac", "")
+        ))
+        conn.commit()
+        cur.close()
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS errors (
-                id SERIAL PRIMARY KEY,
-                error TEXT,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        """)
+    # export automático (contador incremental, export fuera del request)
+    track_inserts(1)
 
+# ------------------------------------------------------
+# 📝 LOG DE ERRORES
+# ------------------------------------------------------
+def _insert_error(conn, msg):
+    cur = conn.cursor()
+    try:
+        # la tabla la crea la migración (services/migrate.py)
         cur.execute("INSERT INTO errors (error) VALUES (%s)", (msg,))
         conn.commit()
+    finally:
         cur.close()
-        conn.close()
+
+
+def log_db_error(msg, conn=None):
+    """
+    Guarda un error en tabla 'errors'. Con `conn` usa esa conexión (ya sin
+    transacción abierta) en vez de pedir otra al pool: quien ya tiene una no
+    debe esperar una segunda, con pools de una sola conexión no llegaría nunca.
+    """
+    try:
+        if conn is not None:
+            _insert_error(conn, msg)
+        else:
+            with db_connection() as pooled:
+                _insert_error(pooled, msg)
 
         print("📝 Error registrado en 'errors'.")
     except Exception as e:
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
         print(f"⚠️ No se pudo registrar error: {e}")
 
 # ------------------------------------------------------
@@ -196,7 +569,7 @@ def generate_csv(rows):
     """Convierte registros a CSV (descarga manual en /admin/export)."""
     output = StringIO()
     writer = csv.writer(output, delimiter=CSV_DELIMITER)
-    writer.writerow(["ID", "Nombre", "Email", "Teléfono", "MAC", "IP", "AP MAC", "Fecha"])
+    writer.writerow(CSV_HEADER)
 
     for row in rows:
         writer.writerow(row)
@@ -204,78 +577,237 @@ def generate_csv(rows):
     return output.getvalue()
 
 # ------------------------------------------------------
-# 🛡 EXPORTACIÓN SEGURA
+# 🌊 CSV EN STREAMING (memoria constante)
 # ------------------------------------------------------
-def safe_export_and_cleanup():
-    conn = None
-    cur = None
+def iter_csv():
+    """CSV por chunks desde un cursor server-side de psycopg2 (fallback sin pool)."""
+    buf = StringIO()
+    w = csv.writer(buf, delimiter=CSV_DELIMITER)
+    w.writerow(CSV_HEADER)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+
+    with db_connection() as conn:
+        # cursor con nombre → server-side, trae STREAM_FETCH_ROWS por vuelta
+        cur = conn.cursor(name="export_stream")
+        cur.itersize = STREAM_FETCH_ROWS
+        cur.execute(f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC")
+        for row in cur:
+            w.writerow(row)
+            if buf.tell() >= STREAM_CHUNK_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        cur.close()
+        conn.commit()
 
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
+    if buf.tell():
+        yield buf.getvalue()
 
-        # 1) Lock fuerte
-        cur.execute(f"LOCK TABLE {TABLE_NAME} IN ACCESS EXCLUSIVE MODE")
 
-        cur.execute(f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC")
-        rows = cur.fetchall()
+async def stream_csv_async(pool):
+    """CSV por chunks desde un cursor asyncpg; el header sale antes de la query."""
+    buf = StringIO()
+    w = csv.writer(buf, delimiter=CSV_DELIMITER)
+    w.writerow(CSV_HEADER)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
 
-        if not rows:
-            conn.commit()
-            return None
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            query = f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC"
+            async for row in conn.cursor(query, prefetch=STREAM_FETCH_ROWS):
+                w.writerow(row)
+                if buf.tell() >= STREAM_CHUNK_BYTES:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
 
-        # 2) CSV en memoria
-        mem = StringIO()
-        w = csv.writer(mem, delimiter=CSV_DELIMITER)
-        w.writerow(["ID", "Nombre", "Email", "Teléfono", "MAC", "IP", "AP MAC", "Fecha"])
+    if buf.tell():
+        yield buf.getvalue()
 
-        for row in rows:
-            if len(row) != 8:
-                raise ValueError(f"Fila corrupta: {row}")
-            w.writerow(row)
+# ------------------------------------------------------
+# 🛡 EXPORTACIÓN SEGURA
+# ------------------------------------------------------
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
-        csv_mem = mem.getvalue()
 
-        # 3) Validar CSV
-        test_mem = list(csv.reader(StringIO(csv_mem), delimiter=CSV_DELIMITER))
-        if len(test_mem) < 2:
-            raise ValueError("CSV vacío o incompleto")
+def _write_manifest(filepath, manifest):
+    """Sidecar <archivo>.manifest.json, escrito también con rename atómico."""
+    manifest_path = filepath + ".manifest.json"
+    tmp = manifest_path + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, manifest_path)
+    return manifest_path
 
-        # 4) Escribir archivo
-        filename = f"{TABLE_NAME}_{datetime.now().strftime(DATE_FORMAT)}.csv"
-        filepath = os.path.join(FINAL_EXPORT_DIR, filename)
 
-        with open(filepath, "w", encoding="utf-8", newline="") as f:
-            f.write(csv_mem)
+def safe_export_and_cleanup():
+    # Duración y resultado en /metrics (ok / vacío-omitido / error)
+    with EXPORT_SECONDS.time():
+        try:
+            with db_connection() as conn:
+                filepath = _safe_export_and_cleanup(conn)
+        except Exception as e:
+            # sin conexión (DB caída / pool agotado); los errores del export se manejan adentro
+            print(f">>>>❌ ERROR exportando CSV: {e}")
+            filepath = None
+    EXPORTS.inc("ok" if filepath else "none")
+    return filepath
+
+
+def _safe_export_and_cleanup(conn):
+    cur = None
+    tmp_path = None
+    published = []
+
+    try:
+        cur = conn.cursor()
 
-        # 5) Releer y verificar
-        with open(filepath, "r", encoding="utf-8") as f:
-            test_disk = list(csv.reader(f, delimiter=CSV_DELIMITER))
+        if EXPORT_MODE == "lock":
+            # 1) Lock fuerte
+            cur.execute(f"LOCK TABLE {TABLE_NAME} IN ACCESS EXCLUSIVE MODE")
+            query, params = f"SELECT * FROM {TABLE_NAME} ORDER BY id DESC", None
+            watermark = None
+        else:
+            # 1) Snapshot fijo (REPEATABLE READ): el SELECT y el DELETE ven las
+            #    mismas filas; lo insertado durante el export queda para el próximo.
+            #    Los inserts no se bloquean; solo se evita otro export en paralelo.
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (EXPORT_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                print("⏳ Ya hay un export en curso, se omite este")
+                conn.rollback()
+                return None
+
+            cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE_NAME}")
+            watermark = cur.fetchone()[0]
+            query = f"SELECT * FROM {TABLE_NAME} WHERE id <= %s ORDER BY id DESC"
+            params = (watermark,)
 
-        if test_disk != test_mem:
-            raise ValueError("El CSV escrito difiere del generado en memoria")
+        filename = f"{TABLE_NAME}_{datetime.now().strftime(DATE_FORMAT)}.csv"
+        filepath = os.path.join(FINAL_EXPORT_DIR, filename)
+        tmp_path = filepath + ".part"
+
+        # 2) Una sola pasada: cursor server-side → CSV → SHA-256 + archivo temporal
+        sha = hashlib.sha256()
+        total_bytes = 0
+        count = 0
+        id_min = id_max = None
+
+        buf = StringIO()
+        w = csv.writer(buf, delimiter=CSV_DELIMITER)
+        w.writerow(CSV_HEADER)
+
+        rows_cur = conn.cursor(name="export_rows")
+        rows_cur.itersize = STREAM_FETCH_ROWS
+        rows_cur.execute(query, params)
+
+        with open(tmp_path, "wb") as f:
+            def _flush_buf():
+                nonlocal total_bytes
+                data = buf.getvalue().encode("utf-8")
+                sha.update(data)
+                f.write(data)
+                total_bytes += len(data)
+                buf.seek(0)
+                buf.truncate()
+
+            for row in rows_cur:
+                if len(row) != 8:
+                    raise ValueError(f"Fila corrupta: {row}")
+                w.writerow(row)
+                count += 1
+                id_min = row[0] if id_min is None else min(id_min, row[0])
+                id_max = row[0] if id_max is None else max(id_max, row[0])
+                if buf.tell() >= STREAM_CHUNK_BYTES:
+                    _flush_buf()
+
+            rows_cur.close()
+
+            if not count:
+                f.close()
+                os.remove(tmp_path)
+                tmp_path = None
+                conn.commit()
+                return None
+
+            _flush_buf()
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 3) Verificar tamaño en disco
+        if os.path.getsize(tmp_path) != total_bytes:
+            raise ValueError("El CSV escrito difiere del generado (tamaño)")
+
+        # 4) BORRADO (sin commit todavía): si no coincide no se publica nada
+        if watermark is None:
+            cur.execute(f"DELETE FROM {TABLE_NAME}")
+        else:
+            cur.execute(f"DELETE FROM {TABLE_NAME} WHERE id <= %s", (watermark,))
+        if cur.rowcount != count:
+            raise ValueError(
+                f"Se exportaron {count} filas pero se borrarían {cur.rowcount}"
+            )
+
+        # 5) Publicar con rename atómico + manifest, y recién ahí commit
+        os.replace(tmp_path, filepath)
+        tmp_path = None
+        published = [filepath]
+        _fsync_dir(FINAL_EXPORT_DIR)
+
+        digest = sha.hexdigest()
+        published.append(_write_manifest(filepath, {
+            "file": filename,
+            "rows": count,
+            "id_min": id_min,
+            "id_max": id_max,
+            "watermark": watermark,
+            "bytes": total_bytes,
+            "sha256": digest,
+            "delimiter": CSV_DELIMITER,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }))
 
-        # 6) BORRADO FINAL (solo si todo OK)
-        cur.execute(f"DELETE FROM {TABLE_NAME}")
         conn.commit()
 
-        print(f"🟢 Exportación segura OK → {filepath}")
+        print(f"🟢 Exportación segura OK → {filepath} ({count} filas, sha256 {digest[:12]}…)")
         return filepath
 
     except Exception as e:
         print(f">>>>❌ ERROR exportando CSV: {e}")
-        log_db_error(str(e))
 
-        if conn:
-            conn.rollback()
+        conn.rollback()
+        # misma conexión (ya con rollback): no pedir otra al pool mientras se tiene esta
+        log_db_error(str(e), conn)
+
+        # Las filas siguen en la tabla: un CSV publicado las duplicaría en el próximo export
+        for path in [tmp_path, *published]:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
 
         return None
 
     finally:
         if cur:
             cur.close()
-        if conn:
-            conn.close()
 
 # ------------------------------------------------------
 # 🚀 EXPORT AUTOMÁTICO
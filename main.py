@@ -3,10 +3,11 @@
 # ------------------------------------------------------
 import asyncio
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import os, configparser
+import os, configparser, time, hashlib, hmac, mimetypes, math
+from urllib.parse import urlencode
 from fastapi import Cookie
 from itsdangerous import URLSafeSerializer, BadSignature
 from database import TABLE_NAME
@@ -43,48 +44,78 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 # AHORA PODEMOS IMPORTAR MÓDULOS LOCALES
 # ------------------------------------------------------
 from database import (
-    db_init,
     db_insert_signup,
+    clean_signup,
+    SIGNUP_FIELD_LIMITS,
     safe_export_and_cleanup,   # o auto_export_and_cleanup
-    db_get_all,
+    db_get_page,
+    db_get_page_async,
+    db_get_stats,
+    db_get_stats_async,
+    db_is_returning_device,
+    db_is_returning_device_async,
+    db_revoke_device,
+    db_revoke_device_async,
     count_records,
-    generate_csv,
+    iter_csv,
+    stream_csv_async,
+    reconcile_record_count,
+    run_count_reconcile,
+    track_inserts,
+    open_async_pool,
+    close_sync_pool,
     CLEANUP_ON_EXPORT,
 )
 from database import auto_export_and_cleanup
+from services.unifi_async import (
+    unifi_guest_approve_async,
+    unifi_guest_revoke_async,
+    controllers_health,
+    close_controllers,
+)
+from services.dispatcher import dispatcher
+from services.mac_cache import mac_cache
+from services.signup_buffer import signup_buffer, WRITE_BEHIND
+from services.admission import signup_limiter, signup_dedupe, client_ip
+from services.known_devices import known_devices, RETURNING_GUEST_DAYS
+from services.auth_outbox import auth_outbox, AUTH_OUTBOX
+from services.migrate import ensure_schema
+from services.assets import build_assets, asset_url, resolve_asset, IMMUTABLE
+from services.metrics import (
+    Gauge,
+    MetricsMiddleware,
+    DB_INSERT_SECONDS,
+    SIGNUP_ADMISSION,
+    RETURNING_GUESTS,
+    MULTIPROCESS as METRICS_MULTIPROCESS,
+    collect_snapshot,
+    render_metrics,
+    run_snapshots,
+)
+
+# Latencia por ruta (GET / POST /, admin, export…) → /metrics
+app.add_middleware(MetricsMiddleware)
+
+# {{ asset_url('tw.css') }} en cualquier template → URL con hash
+templates.env.globals["asset_url"] = asset_url
 
 # ------------------------------------------------------
-# LOGGING SENCILLO
+# LOGGING (cola + thread escritor, ver services/logger.py)
 # ------------------------------------------------------
+from services.logger import get_logger, DroppingQueueHandler
+
 DEBUG_MODE = config["Admin"].get("debug", "no").lower() == "yes"
-LOG_DIR = os.path.join(BASE_DIR, "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE = os.path.join(LOG_DIR, "log.txt")
+logger = get_logger("portal")
 
 
 def log_info(msg: str):
     if not DEBUG_MODE:
         return
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    final = f"[{ts}] INFO: {msg}"
-    print(final, flush=True)
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(final + "\n")
-    except Exception:
-        pass
+    logger.info(msg)
 
 
 def log_error(msg: str):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    final = f"[{ts}] ERROR: {msg}"
-    print(final, flush=True)
-    if DEBUG_MODE:
-        try:
-            with open(LOG_FILE, "a", encoding="utf-8") as f:
-                f.write(final + "\n")
-        except Exception:
-            pass
+    logger.error(msg)
 
 
 print(
@@ -94,9 +125,6 @@ print(
     flush=True,
 )
 
-# Inicializar DB al levantar
-db_init()
-
 # ------------------------------------------------------
 # AUTH  PARA /admin
 # ------------------------------------------------------
@@ -126,31 +154,146 @@ import re
 
 
 def is_valid_email(email: str) -> bool:
+    email = email.strip()
+    if len(email) > SIGNUP_FIELD_LIMITS["email"] or "\x00" in email:
+        return False
     pattern = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
-    return bool(re.match(pattern, email.strip()))
+    return bool(re.match(pattern, email))
+
+
+# ------------------------------------------------------
+# ASSETS CON HASH (cache inmutable)
+# ------------------------------------------------------
+@app.get("/assets/{name}")
+async def assets(name: str, request: Request):
+    path, encoding = resolve_asset(name, request.headers.get("accept-encoding", ""))
+    if path is None:
+        raise HTTPException(status_code=404)
+
+    headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 
 # ------------------------------------------------------
 # INDEX (GET)
 # ------------------------------------------------------
-@app.get("/", response_class=HTMLResponse)
-async def index(request: Request, status: str | None = None):
-    hotel_name = config["General"].get("hotel_name", "Portal Wi-Fi")
-    logo_file = config["General"].get("logo_file", "logo.jpg")
-    redirect_url = config["Redirect"].get("default_url")
-    redirect_delay = int(config["Redirect"].get("redirect_delay", "3"))
-    default_languaje = config["General"].get("default_language")
+PORTAL_LANGS = ("es", "en", "pt")
+PORTAL_STATUSES = (None, "success", "error")
+# Cada cuánto (segundos) como mucho se mira el mtime de config.ini / index.html
+RELOAD_CHECK_INTERVAL = 1.0
 
-    # status: None | "success" | "error"
+_page_cache: dict[tuple, tuple[bytes, str]] = {}
+_watched_mtimes: tuple | None = None
+_last_reload_check = 0.0
+
+
+def _current_mtimes():
+    paths = (CONFIG_PATH, os.path.join(BASE_DIR, "templates", "index.html"))
+    out = []
+    for p in paths:
+        try:
+            out.append(os.stat(p).st_mtime_ns)
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+def _check_reload():
+    """Si cambió config.ini o el template: recarga config y vacía la cache de páginas."""
+    global _watched_mtimes, _last_reload_check
+    now = time.monotonic()
+    if now - _last_reload_check < RELOAD_CHECK_INTERVAL:
+        return
+    _last_reload_check = now
+
+    mtimes = _current_mtimes()
+    if mtimes == _watched_mtimes:
+        return
+    if _watched_mtimes is not None:
+        config.clear()
+        config.read(CONFIG_PATH)
+        log_info("config.ini / index.html cambió → recargando portal")
+    _watched_mtimes = mtimes
+    _page_cache.clear()
+
+
+def _portal_lang(request: Request, lang: str | None) -> str:
+    if lang in PORTAL_LANGS:
+        return lang
+    accept = request.headers.get("accept-language", "")[:2].lower()
+    if accept in PORTAL_LANGS:
+        return accept
+    default = (config["General"].get("default_language") or "es").lower()
+    return default if default in PORTAL_LANGS else "es"
+
+
+def _render_portal(status: str | None, lang: str) -> tuple[bytes, str]:
     context = {
-        "request": request,
-        "hotel_name": hotel_name,
-        "logo_file": logo_file,
-        "redirect_url": redirect_url,
-        "redirect_delay": redirect_delay,
+        "hotel_name": config["General"].get("hotel_name", "Portal Wi-Fi"),
+        "logo_file": config["General"].get("logo_file", "portal.png"),
+        "redirect_url": config["Redirect"].get("default_url"),
+        "redirect_delay": int(config["Redirect"].get("redirect_delay", "3")),
         "status": status,  # tendrás que usarlo en index.html si querés mensajes
+        "lang": lang,
     }
-    return templates.TemplateResponse("index.html", context)
+    body = templates.get_template("index.html").render(context).encode("utf-8")
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return body, etag
+
+
+async def _is_returning_guest(mac: str) -> bool:
+    """MAC registrada dentro de returning_guest_days (cache → PK de dispositivos)."""
+    known = known_devices.get(mac)
+    if known is not None:
+        return known
+    try:
+        if db_pool is not None:
+            known = await db_is_returning_device_async(db_pool, mac, RETURNING_GUEST_DAYS)
+        else:
+            known = await asyncio.to_thread(db_is_returning_device, mac, RETURNING_GUEST_DAYS)
+    except Exception as e:
+        # DB caída: formulario normal (y no reintentar en cada GET hasta que venza la cache)
+        log_error(f"Lookup de MAC conocida falló MAC={mac}: {e}")
+        known = False
+    known_devices.put(mac, known)
+    return known
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request, status: str | None = None, lang: str | None = None):
+    # status: None | "success" | "error"
+    if status not in PORTAL_STATUSES:
+        status = None
+    lang = _portal_lang(request, lang)
+
+    # Huésped que vuelve (UniFi redirige con ?id=<mac>): autorizar y mandarlo
+    # directo a default_url, sin formulario. Si el controlador falla → formulario.
+    qp = request.query_params
+    mac = qp.get("id", "")
+    if mac and status is None and RETURNING_GUEST_DAYS > 0 and await _is_returning_guest(mac):
+        if await unifi_guest_approve_async(mac, qp.get("ap"), qp.get("ssid")):
+            RETURNING_GUESTS.inc("authorized")
+            log_info(f"Huésped conocido autorizado sin formulario MAC={mac}")
+            return RedirectResponse(url=config["Redirect"].get("default_url"), status_code=302)
+        RETURNING_GUESTS.inc("failed")
+        log_error(f"UniFi no autorizó huésped conocido MAC={mac}, se muestra el formulario")
+
+    # Página pre-renderizada por (status, idioma); se invalida si cambia config.ini
+    _check_reload()
+    key = (status, lang)
+    cached = _page_cache.get(key)
+    if cached is None:
+        cached = _render_portal(status, lang)
+        _page_cache[key] = cached
+    body, etag = cached
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Language"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
 
 
 # ------------------------------------------------------
@@ -163,40 +306,165 @@ async def index_post(
     email: str = Form(...),
     phone: str = Form(""),
 ):
-    # Query params
+    # Query params (UniFi redirige con ?id=<mac cliente>&ap=<mac AP>&ssid=...)
+    qp = request.query_params
 
     if not fullname or not is_valid_email(email):
         # redirigimos con status=error
         url = app.url_path_for("index") + "?status=error"
         return RedirectResponse(url=url, status_code=302)
 
+    # recortado / sin NUL: una fila que la tabla rechace no debe llegar al buffer
+    signup = clean_signup({
+        "fullname": fullname.strip(),
+        "email": email.strip(),
+        "phone": phone.strip(),
+        "client_mac": qp.get("id", ""),
+        "client_ip": client_ip(request.client.host if request.client else "", request.headers.get("x-real-ip")),
+        "ap_mac": qp.get("ap", ""),
+    })
+    ssid = (qp.get("ssid") or "").replace("\x00", "")[:100] or None
+
+    # Reenvíos del mismo formulario (doble click, captive browser que reintenta):
+    # devuelven el resultado anterior sin otra fila ni otra llamada al controlador
+    key = signup_dedupe.fingerprint(
+        signup["client_mac"] or signup["client_ip"],
+        signup["email"], signup["fullname"], signup["phone"], signup["ap_mac"],
+    )
+
+    retry_after = 0.0
+
+    async def _admit_and_process():
+        # Token bucket por MAC y por IP: protege DB y controlador de tormentas de reenvíos
+        nonlocal retry_after
+        retry_after = signup_limiter.allow(
+            signup["client_mac"] and f"mac:{signup['client_mac'].lower()}",
+            signup["client_ip"] and f"ip:{signup['client_ip']}",
+        )
+        if retry_after:
+            return "limited"
+        return await _process_signup(signup, ssid)
+
+    status, duplicate = await signup_dedupe.run(key, _admit_and_process)
+    if status == "limited":
+        SIGNUP_ADMISSION.inc("limited")
+        log_info(f"Signup limitado MAC={signup['client_mac']} IP={signup['client_ip']}")
+        return HTMLResponse(
+            "Demasiados intentos, esperá unos segundos. / Too many attempts, please wait.",
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))},
+        )
+    SIGNUP_ADMISSION.inc("duplicate" if duplicate else "admitted")
+
+    url = app.url_path_for("index") + f"?status={status}"
+    return RedirectResponse(url=url, status_code=302)
+
 
+async def _process_signup(signup: dict, ssid: str | None) -> str:
+    """Guarda el signup y autoriza en UniFi; devuelve el status para el portal."""
     # 1) Guardar en DB
     try:
         await db_insert_signup_async(signup)
-    except Exception:
-        db_init()
-        await db_insert_signup_async(signup)
+    except Exception as e:
+        log_error(f"Error guardando signup MAC={signup['client_mac']}: {e}")
+        raise
 
+    if signup["client_mac"]:
+        known_devices.put(signup["client_mac"], True)
 
-    status = "success"
-    url = app.url_path_for("index") + f"?status={status}"
-    return RedirectResponse(url=url, status_code=302)
+    # 2) Autorizar en UniFi. Con outbox: se responde apenas queda guardada en la DB
+    #    y un worker la intenta (y reintenta con backoff) sin que el guest espere
+    if auth_outbox.running and signup["client_mac"]:
+        try:
+            await auth_outbox.enqueue(signup["client_mac"], signup["ap_mac"], ssid)
+            return "success"
+        except Exception as e:
+            log_error(f"No se pudo encolar la autorización MAC={signup['client_mac']}: {e} → directo")
+
+    ok = await unifi_guest_approve_async(signup["client_mac"], signup["ap_mac"], ssid)
+    if not ok:
+        log_error(f"UniFi no autorizó MAC={signup['client_mac']}")
+
+    return "success" if ok else "error"
 
 
 
 # ------------------------------------------------------
 # ADMIN PANEL
 # ------------------------------------------------------
+ADMIN_PAGE_SIZE = int(config["Admin"].get("page_size", "50"))
+
+
+def _parse_date(value: str | None):
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").date() if value else None
+    except ValueError:
+        return None
+
+
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_panel(request: Request, _: bool = Depends(require_admin)):
-    registros = db_get_all()
-    # admin.html ya espera 'registros' y usa request para el link CSV :contentReference[oaicite:1]{index=1}
+async def admin_panel(
+    request: Request,
+    email: str = "",
+    client_mac: str = "",
+    ap_mac: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    before: int | None = None,
+    after: int | None = None,
+    _: bool = Depends(require_admin),
+):
+    filters = {
+        "email": email.strip(),
+        "client_mac": client_mac.strip().replace("-", ":"),
+        "ap_mac": ap_mac.strip().replace("-", ":"),
+        "date_from": _parse_date(date_from),
+        "date_to": _parse_date(date_to),
+    }
+
+    # Solo una página (keyset sobre id): el costo no depende del tamaño de la tabla
+    if db_pool is not None:
+        page = await db_get_page_async(db_pool, filters, before, after, ADMIN_PAGE_SIZE)
+    else:
+        page = await asyncio.to_thread(db_get_page, filters, before, after, ADMIN_PAGE_SIZE)
+
+    registros = page["rows"]
+    # query string de los filtros, para mantenerlos al paginar
+    filter_qs = urlencode({k: v for k, v in {
+        "email": email, "client_mac": client_mac, "ap_mac": ap_mac,
+        "date_from": date_from, "date_to": date_to,
+    }.items() if v})
+
     return templates.TemplateResponse(
         "admin.html",
         {
             "request": request,
             "registros": registros,
+            "filters": {
+                "email": email, "client_mac": client_mac, "ap_mac": ap_mac,
+                "date_from": date_from, "date_to": date_to,
+            },
+            "filter_qs": filter_qs,
+            "newer_id": registros[0][0] if registros and page["has_newer"] else None,
+            "older_id": registros[-1][0] if registros and page["has_older"] else None,
+        },
+    )
+
+@app.get("/admin/stats", response_class=HTMLResponse)
+async def admin_stats(request: Request, days: int = 7, _: bool = Depends(require_admin)):
+    days = max(1, min(days, 90))
+    # Solo lee las tablas de rollup: barato aunque la tabla cruda sea enorme o esté vacía
+    if db_pool is not None:
+        stats = await db_get_stats_async(db_pool, days)
+    else:
+        stats = await asyncio.to_thread(db_get_stats, days)
+
+    return templates.TemplateResponse(
+        "stats.html",
+        {
+            "request": request,
+            "days": days,
+            **stats,
         },
     )
 
@@ -259,37 +527,168 @@ import asyncpg
 
 db_pool: asyncpg.Pool | None = None
 
+# Tareas de fondo de este worker (se cancelan en el shutdown)
+_background: dict[str, asyncio.Task] = {}
+
+
 @app.on_event("startup")
 async def startup_event():
     global db_pool
-    db_pool = await asyncpg.create_pool(
-        host=os.getenv("DB_HOST", "db"),
-        port=int(os.getenv("DB_PORT", "5432")),
-        user=os.getenv("DB_USER", "portal"),
-        password=os.getenv("DB_PASS", "portal123"),
-        database=os.getenv("DB_NAME", "captive_portal"),
-        min_size=1,
-        max_size=5,
-    )
+    # logos achicados + CSS pre-comprimido con nombres por contenido
+    try:
+        await asyncio.to_thread(build_assets)
+        _page_cache.clear()
+    except Exception as e:
+        log_error(f"Error generando assets: {e}")
+
+    # Esquema: un SELECT de la versión; migra (con advisory lock) solo si falta algo
+    try:
+        await asyncio.to_thread(ensure_schema)
+    except Exception as e:
+        log_error(f"No se pudo verificar/migrar el esquema: {e}")
+
+    # Tamaños en [Database] pool_min_size / pool_max_size (ver database.py)
+    db_pool = await open_async_pool()
+    try:
+        await asyncio.to_thread(reconcile_record_count)
+    except Exception as e:
+        log_error(f"No se pudo contar registros al iniciar: {e}")
+    # el COUNT(*) periódico corre acá, nunca dentro de un request
+    _background["reconcile"] = asyncio.create_task(run_count_reconcile())
+    if WRITE_BEHIND:
+        await signup_buffer.start(db_pool)
+    if AUTH_OUTBOX:
+        await auth_outbox.start(db_pool)
+    if METRICS_MULTIPROCESS:
+        _background["metrics"] = asyncio.create_task(run_snapshots())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if auth_outbox.running:
+        await auth_outbox.stop()
+    await close_controllers()
+    if signup_buffer.running:
+        await signup_buffer.stop()
+    if db_pool is not None:
+        await db_pool.close()
+    await asyncio.to_thread(close_sync_pool)
+    # al final: el último volcado de métricas ya incluye el shutdown
+    for task in _background.values():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _background.clear()
 
 async def db_insert_signup_async(data: dict):
     global db_pool
     if db_pool is None:
         # fallback por si algo falla
-        return await asyncio.to_thread(db_insert_signup, data)
-
-    async with db_pool.acquire() as conn:
-        await conn.execute(f"""
-            INSERT INTO {TABLE_NAME} (fullname, email, phone, client_mac, client_ip, ap_mac)
-            VALUES ($1, $2, $3, $4, $5, $6)
-        """,
-        data["fullname"],
-        data["email"],
-        data.get("phone", ""),
-        data.get("client_mac", ""),
-        data.get("client_ip", ""),
-        data.get("ap_mac", "")
-        )
+        with DB_INSERT_SECONDS.time("thread"):
+            return await asyncio.to_thread(db_insert_signup, data)
+
+    if signup_buffer.running:
+        # write-behind: spool en disco + COPY por lotes en background
+        with DB_INSERT_SECONDS.time("buffer"):
+            await signup_buffer.add(data)
+        return
+
+    with DB_INSERT_SECONDS.time("direct"):
+        async with db_pool.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO {TABLE_NAME} (fullname, email, phone, client_mac, client_ip, ap_mac)
+                VALUES ($1, $2, $3, $4, $5, $6)
+            """,
+            data["fullname"],
+            data["email"],
+            data.get("phone", ""),
+            data.get("client_mac", ""),
+            data.get("client_ip", ""),
+            data.get("ap_mac", "")
+            )
+    await asyncio.to_thread(track_inserts, 1)
+
+# ------------------------------------------------------
+# ESTADO UNIFI (cola / latencias del dispatcher)
+# ------------------------------------------------------
+@app.get("/admin/unifi/stats")
+async def unifi_stats(_: bool = Depends(require_admin)):
+    stats = dispatcher.stats()
+    stats["mac_cache"] = mac_cache.stats()
+    stats["breakers"] = controllers_health()
+    return stats
+
+
+@app.post("/admin/unifi/revoke")
+async def unifi_revoke(
+    client_mac: str = Form(...),
+    ap_mac: str = Form(""),
+    _: bool = Depends(require_admin),
+):
+    client_mac = client_mac.strip()
+    # Primero la DB + cache: aunque el controlador falle, el GET / ya no re-autoriza sin formulario
+    known_devices.put(client_mac, False)
+    try:
+        if db_pool is not None:
+            await db_revoke_device_async(db_pool, client_mac)
+        else:
+            await asyncio.to_thread(db_revoke_device, client_mac)
+    except Exception as e:
+        log_error(f"No se pudo marcar la MAC revocada MAC={client_mac}: {e}")
+    ok = await unifi_guest_revoke_async(client_mac, ap_mac.strip() or None)
+    return {"client_mac": client_mac, "ok": ok}
+
+
+# ------------------------------------------------------
+# MÉTRICAS PROMETHEUS
+# ------------------------------------------------------
+# Requiere token (Bearer o ?token=): el puerto 80 lo ven los huéspedes. Sin token → 404
+METRICS_TOKEN = config["Admin"].get("metrics_token", "")
+
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+Gauge("portal_db_pool_size", "Conexiones abiertas en el pool asyncpg", lambda: db_pool.get_size())
+Gauge("portal_db_pool_idle", "Conexiones libres en el pool asyncpg", lambda: db_pool.get_idle_size())
+Gauge("portal_signup_buffer_pending", "Signups en buffer/spool sin insertar",
+      lambda: signup_buffer.stats()["pending"])
+Gauge("portal_unifi_inflight", "Autorizaciones UniFi en curso (MACs distintas)",
+      lambda: dispatcher.stats()["inflight"])
+Gauge("portal_unifi_waiting", "Autorizaciones esperando turno por controlador",
+      lambda: {(k,): v["waiting"] for k, v in dispatcher.stats()["controllers"].items()},
+      ("controller",))
+Gauge("portal_unifi_running", "Autorizaciones ejecutándose por controlador",
+      lambda: {(k,): v["running"] for k, v in dispatcher.stats()["controllers"].items()},
+      ("controller",))
+Gauge("portal_unifi_breaker_state", "Circuit breaker (0=closed, 1=half_open, 2=open)",
+      lambda: {(k,): _BREAKER_STATES.get(v["state"], 0) for k, v in controllers_health().items()},
+      ("controller",), aggregate="max")
+Gauge("portal_mac_cache_entries", "MACs autorizadas en cache", lambda: mac_cache.stats()["size"])
+Gauge("portal_auth_outbox_inflight", "Autorizaciones del outbox intentándose en este worker",
+      lambda: auth_outbox.stats()["inflight"])
+Gauge("portal_known_device_cache_entries", "MACs en cache del fast path de huéspedes que vuelven",
+      lambda: known_devices.stats()["size"])
+Gauge("portal_signup_limiter_keys", "MACs/IPs con bucket activo en el limitador de POST /",
+      lambda: len(signup_limiter))
+Gauge("portal_log_dropped", "Mensajes de log descartados (cola llena)", lambda: DroppingQueueHandler.dropped)
+
+
+@app.get("/metrics")
+async def metrics(request: Request, token: str = ""):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404)
+    auth = request.headers.get("authorization", "")
+    if not (
+        hmac.compare_digest(token, METRICS_TOKEN)
+        or hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}")
+    ):
+        raise HTTPException(status_code=403)
+    # gauges en el loop; volcado / lectura de los otros workers en un thread
+    own = collect_snapshot()
+    text = await asyncio.to_thread(render_metrics, own)
+    return Response(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 # ------------------------------------------------------
 # EXPORT CSV
@@ -297,24 +696,21 @@ async def db_insert_signup_async(data: dict):
 @app.get("/admin/export")
 async def export_csv(_: bool = Depends(require_admin)):
     if CLEANUP_ON_EXPORT:
-        filepath = safe_export_and_cleanup()
+        # export + borrado en un thread; el archivo se manda desde disco sin cargarlo
+        filepath = await asyncio.to_thread(safe_export_and_cleanup)
         if not filepath:
             return Response("Error exportando CSV.", media_type="text/plain")
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            csv_data = f.read()
-
-        filename = os.path.basename(filepath)
-        return Response(
-            csv_data,
+        return FileResponse(
+            filepath,
             media_type="text/csv",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            filename=os.path.basename(filepath),
         )
     else:
-        rows = db_get_all()
-        csv_data = generate_csv(rows)
-        return Response(
-            csv_data,
+        # streaming desde cursor: memoria constante y primer byte inmediato
+        chunks = stream_csv_async(db_pool) if db_pool is not None else iter_csv()
+        return StreamingResponse(
+            chunks,
             media_type="text/csv",
             headers={
                 "Content-Disposition": 'attachment; filename="signups_manual.csv"'
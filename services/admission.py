@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import ipaddress
+import time
+from collections import OrderedDict
+
+from database import config
+from services.broadcast import SharedGeneration
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+# Envíos de formulario por MAC / IP: ráfaga inicial y ritmo sostenido (por minuto)
+SIGNUP_BURST = float(config["General"].get("signup_burst", "5"))
+SIGNUP_RATE_PER_MIN = float(config["General"].get("signup_rate_per_min", "6"))
+# Segundos en que un envío idéntico devuelve el resultado anterior sin repetir nada
+SIGNUP_DEDUPE_SECONDS = float(config["General"].get("signup_dedupe_seconds", "30"))
+# Claves máximas en memoria (las más viejas se descartan)
+ADMISSION_MAX_KEYS = int(config["General"].get("admission_max_keys", "20000"))
+# IPs / redes del reverse proxy (nginx): solo desde ellas se cree el header X-Real-IP
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in config["General"].get("trusted_proxies", "127.0.0.1, ::1, 172.16.0.0/12").split(",")
+    if p.strip()
+]
+
+
+def client_ip(peer: str, real_ip: str | None) -> str:
+    """IP del cliente: X-Real-IP si la conexión viene del proxy; si no, la del socket (no falsificable)."""
+    if not real_ip or not peer:
+        return peer
+    try:
+        addr = ipaddress.ip_address(peer)
+    except ValueError:
+        return peer
+    if any(addr in net for net in TRUSTED_PROXIES):
+        return real_ip.strip()
+    return peer
+
+
+# ------------------------------------------------------
+# LIMITADOR TOKEN BUCKET (por MAC y por IP)
+# ------------------------------------------------------
+class TokenBucketLimiter:
+    """Un bucket por clave (LRU acotado); allow() consume un token de cada clave o de ninguna."""
+
+    def __init__(self, burst=SIGNUP_BURST, rate_per_min=SIGNUP_RATE_PER_MIN, max_keys=ADMISSION_MAX_KEYS):
+        self.burst = burst
+        self.rate = rate_per_min / 60
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def _tokens(self, key, now) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, last = bucket
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def allow(self, *keys) -> float:
+        """0 si se admite; si no, segundos hasta que haya token (para Retry-After)."""
+        keys = [k for k in keys if k]
+        if not keys or self.burst <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens = {k: self._tokens(k, now) for k in keys}
+        short = [k for k, t in tokens.items() if t < 1]
+        if short:
+            if self.rate <= 0:
+                return float("inf")
+            return max((1 - tokens[k]) / self.rate for k in short)
+
+        for k, t in tokens.items():
+            self._buckets[k] = (t - 1, now)
+            self._buckets.move_to_end(k)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return 0.0
+
+    def clear(self):
+        self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# ------------------------------------------------------
+# ENVÍOS DUPLICADOS (cache de idempotencia)
+# ------------------------------------------------------
+class IdempotencyCache:
+    """
+    Resultado de cada envío por huella (MAC/IP + datos del formulario) durante
+    `ttl` segundos. Un envío idéntico mientras el primero sigue en curso espera
+    ese mismo resultado en vez de insertar otra fila y volver al controlador.
+    Solo se recuerdan los éxitos: un envío fallido se puede reintentar, y con
+    `shared` una revocación (en cualquier worker) olvida los éxitos guardados.
+    """
+
+    def __init__(self, ttl=SIGNUP_DEDUPE_SECONDS, max_size=ADMISSION_MAX_KEYS, shared=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared: SharedGeneration | None = shared
+        self._done: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def fingerprint(*parts) -> str:
+        raw = "\x1f".join(str(p or "").strip().lower() for p in parts)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def run(self, key, fn) -> tuple[str, bool]:
+        """(resultado, duplicado): ejecuta `await fn()` una sola vez por clave y ventana."""
+        if self.ttl <= 0:
+            return await fn(), False
+
+        if self.shared is not None and self.shared.changed():
+            self._done.clear()
+        hit = self._done.get(key)
+        if hit is not None:
+            if hit[0] > time.monotonic():
+                return hit[1], True
+            del self._done[key]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # que nadie quede con la excepción sin leer si no había duplicados esperando
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if result == "success":
+                self._done[key] = (time.monotonic() + self.ttl, result)
+                while len(self._done) > self.max_size:
+                    self._done.popitem(last=False)
+            return result, False
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._done.clear()
+
+    def __len__(self):
+        return len(self._done) + len(self._inflight)
+
+
+signup_limiter = TokenBucketLimiter()
+signup_dedupe = IdempotencyCache(shared=SharedGeneration())
@@ -0,0 +1,171 @@
+import os
+import gzip
+import hashlib
+import configparser
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:  # sin Pillow: los logos se sirven tal cual (con hash)
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # sin brotli: solo .gz
+    brotli = None
+
+from services.logger import get_logger
+
+_logger = get_logger("portal.assets")
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
+
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+BUILD_DIR = os.path.join(BASE_DIR, "static_build")
+ASSETS_PREFIX = "/assets"
+
+# Ancho máximo del logo (se muestra a 240px → 2x para pantallas retina)
+# (fallback: en el docker build todavía no está montado config.ini)
+LOGO_MAX_PX = int(config.get("General", "logo_max_px", fallback="480"))
+IMAGE_QUALITY = 82
+
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+COMPRESS_EXTS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# nombre lógico (static/) → {"url": ..., "webp": ...}
+_manifest: dict[str, dict] = {}
+# nombre con hash → ruta en BUILD_DIR
+_files: dict[str, str] = {}
+
+
+def _write_atomic(path, data: bytes):
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _register(name, data: bytes):
+    path = os.path.join(BUILD_DIR, name)
+    _write_atomic(path, data)
+    _files[name] = path
+    return f"{ASSETS_PREFIX}/{name}"
+
+
+def _compress_variants(name, data: bytes):
+    path = os.path.join(BUILD_DIR, name)
+    _write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(path + ".br", brotli.compress(data, quality=11))
+
+
+def _encode(img, fmt):
+    out = BytesIO()
+    if fmt == "JPEG":
+        img.convert("RGB").save(out, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        img.save(out, "WEBP", quality=IMAGE_QUALITY, method=6)
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _build_image(stem, digest, ext, src_path):
+    fmt = {".png": "PNG", ".webp": "WEBP"}.get(ext, "JPEG")
+    with Image.open(src_path) as img:
+        # open() solo lee el header: si las variantes ya existen no se decodifica
+        width = min(img.width, LOGO_MAX_PX)
+        names = {"url": f"{stem}.{digest}.{width}{ext}"}
+        if ext != ".webp":
+            names["webp"] = f"{stem}.{digest}.{width}.webp"
+
+        pending = [k for k, n in names.items() if not os.path.exists(os.path.join(BUILD_DIR, n))]
+        if pending:
+            img.load()
+            if img.width > width:
+                height = round(img.height * width / img.width)
+                img = img.resize((width, height), Image.LANCZOS)
+
+        entry = {}
+        for key, name in names.items():
+            data = _encode(img, "WEBP" if key == "webp" else fmt) if key in pending else b""
+            entry[key] = _register(name, data)
+    return entry
+
+
+# ------------------------------------------------------
+# 🏗 BUILD (startup / docker build)
+# ------------------------------------------------------
+def build_assets():
+    """
+    Genera static_build/ con nombres por contenido: logos achicados y
+    re-encodeados (+ WebP) y CSS/JS pre-comprimidos (.gz / .br). Es
+    idempotente: si el archivo con ese hash ya existe no se rehace.
+    """
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest, built = {}, 0
+
+    for name in sorted(os.listdir(STATIC_DIR)):
+        src_path = os.path.join(STATIC_DIR, name)
+        if not os.path.isfile(src_path):
+            continue
+
+        with open(src_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        ext = ext.lower()
+
+        try:
+            if ext in IMAGE_EXTS and Image is not None:
+                manifest[name] = _build_image(stem, digest, ext, src_path)
+            else:
+                hashed = f"{stem}.{digest}{ext}"
+                manifest[name] = {"url": _register(hashed, data)}
+                if ext in COMPRESS_EXTS:
+                    _compress_variants(hashed, data)
+            built += 1
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudo procesar asset '{name}': {e}")
+
+    _manifest.clear()
+    _manifest.update(manifest)
+    _logger.info(f"🟢 Assets OK ({built} archivos) → {BUILD_DIR}")
+    return manifest
+
+
+def asset_url(name: str, variant: str = "url") -> str | None:
+    """URL con hash de un archivo de static/; si no hay build, la ruta /static normal."""
+    entry = _manifest.get(name)
+    if entry is None:
+        return f"/static/{name}" if variant == "url" else None
+    return entry.get(variant)
+
+
+def resolve_asset(name: str, accept_encoding: str = ""):
+    """(ruta, content-encoding) del archivo a servir, prefiriendo .br / .gz."""
+    path = _files.get(name)
+    if path is None:
+        return None, None
+    accept_encoding = accept_encoding.lower()
+    if os.path.splitext(name)[1].lower() in COMPRESS_EXTS:
+        if "br" in accept_encoding and os.path.exists(path + ".br"):
+            return path + ".br", "br"
+        if "gzip" in accept_encoding and os.path.exists(path + ".gz"):
+            return path + ".gz", "gzip"
+    return path, None
+
+
+if __name__ == "__main__":
+    build_assets()
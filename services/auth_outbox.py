@@ -0,0 +1,258 @@
+import asyncio
+import random
+
+import asyncpg
+
+from database import OUTBOX_TABLE, config
+from services.dispatcher import AUTH_DEADLINE
+from services.logger import get_logger
+from services.metrics import OUTBOX_ATTEMPTS
+from services.unifi_async import unifi_guest_approve_async
+
+_logger = get_logger("portal.outbox")
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+# yes → POST / responde apenas la autorización queda en el outbox (la hace un worker en background)
+AUTH_OUTBOX = config["Unifi"].get("auth_outbox", "yes").lower() == "yes"
+# Cada cuántos segundos se buscan reintentos vencidos (o filas de otros workers)
+POLL_INTERVAL = float(config["Unifi"].get("outbox_poll_interval", "2"))
+# Autorizaciones en curso a la vez por worker (el dispatcher además limita por controlador)
+MAX_INFLIGHT = int(config["Unifi"].get("outbox_max_inflight", "50"))
+# Backoff exponencial: base * 2^(intento-1) segundos, tope retry_max, y se abandona tras max_attempts
+RETRY_BASE = float(config["Unifi"].get("outbox_retry_base", "2"))
+RETRY_MAX = float(config["Unifi"].get("outbox_retry_max", "300"))
+MAX_ATTEMPTS = int(config["Unifi"].get("outbox_max_attempts", "30"))
+# Días que se guardan las filas done / failed
+KEEP_DAYS = int(config["Unifi"].get("outbox_keep_days", "7"))
+
+# Mientras un worker intenta una fila nadie más la toma (el intento dura como mucho AUTH_DEADLINE)
+LEASE_SECONDS = AUTH_DEADLINE * 3
+CLEANUP_INTERVAL = 3600
+
+
+def backoff(attempts: int) -> float:
+    """Segundos hasta el próximo intento (con ±20% de jitter para no sincronizar reintentos)."""
+    delay = min(RETRY_MAX, RETRY_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+ENQUEUE_SQL = f"""
+    INSERT INTO {OUTBOX_TABLE} AS o (client_mac, ap_mac, ssid, attempts, next_attempt_at)
+    VALUES ($1, $2, $3, $5, NOW() + make_interval(secs => $4))
+    ON CONFLICT ((lower(client_mac))) WHERE status = 'pending' DO UPDATE SET
+        ap_mac = EXCLUDED.ap_mac,
+        ssid = EXCLUDED.ssid,
+        attempts = EXCLUDED.attempts,
+        next_attempt_at = EXCLUDED.next_attempt_at,
+        updated_at = NOW()
+    RETURNING id, client_mac, ap_mac, ssid, attempts
+"""
+
+# SKIP LOCKED: con varios workers cada fila vencida la toma uno solo
+CLAIM_SQL = f"""
+    UPDATE {OUTBOX_TABLE} o
+    SET attempts = o.attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => $2),
+        updated_at = NOW()
+    WHERE o.id IN (
+        SELECT id FROM {OUTBOX_TABLE}
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.id, o.client_mac, o.ap_mac, o.ssid, o.attempts
+"""
+
+
+# ------------------------------------------------------
+# 📮 OUTBOX DE AUTORIZACIONES UNIFI
+# ------------------------------------------------------
+class AuthOutbox:
+    """
+    Autorizaciones pendientes guardadas en Postgres. enqueue() deja la fila y
+    hace el primer intento en background; si el controlador falla, el loop la
+    reintenta con backoff exponencial hasta max_attempts. Sobrevive reinicios:
+    al arrancar se retoman las filas pendientes. Revocar la MAC desde el admin
+    deja su fila en 'cancelled' (database.db_revoke_device).
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL, max_inflight=MAX_INFLIGHT, max_attempts=MAX_ATTEMPTS):
+        self.poll_interval = poll_interval
+        self.max_inflight = max_inflight
+        self.max_attempts = max_attempts
+
+        self.pool: asyncpg.Pool | None = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: dict[int, asyncio.Task] = {}
+        # hay filas vencidas esperando lugar: al terminar un intento se despierta el loop
+        self._backlog = False
+        self._stopping = False
+
+        self.counters = {"enqueued": 0, "ok": 0, "retry": 0, "failed": 0, "errors": 0}
+
+    # ---------- ciclo de vida ----------
+    async def start(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    async def stop(self):
+        if self._task:
+            # flag además de cancel(): wait_for puede tragarse la cancelación si
+            # justo se despierta el evento (un intento que termina) y el loop seguiría
+            self._stopping = True
+            self._wake.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # los intentos en curso terminan (como mucho AUTH_DEADLINE); si no, vence el lease y se retoman
+        pending = list(self._inflight.values())
+        if pending:
+            _, still = await asyncio.wait(pending, timeout=AUTH_DEADLINE)
+            for t in still:
+                t.cancel()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # ---------- API ----------
+    async def enqueue(self, client_mac: str, ap_mac: str | None, ssid: str | None) -> int:
+        """Guarda la autorización (una pendiente por MAC) y la intenta ya si hay lugar. Devuelve el id."""
+        # Con lugar se toma la fila en el mismo INSERT (lease); si no, queda vencida para el loop
+        claim = len(self._inflight) < self.max_inflight
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                ENQUEUE_SQL, client_mac, ap_mac or "", ssid or "",
+                LEASE_SECONDS if claim else 0.0, 1 if claim else 0,
+            )
+        self.counters["enqueued"] += 1
+        if claim:
+            self._spawn(row)
+        else:
+            self._backlog = True
+            self._wake.set()
+        return row["id"]
+
+    def _spawn(self, row):
+        if row["id"] in self._inflight:
+            return
+        task = asyncio.create_task(self._attempt(row))
+        self._inflight[row["id"]] = task
+        task.add_done_callback(lambda _t: self._done(row["id"]))
+
+    def _done(self, row_id):
+        self._inflight.pop(row_id, None)
+        if self._backlog:
+            self._wake.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_cleanup = loop.time()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.process_due()
+                if loop.time() >= next_cleanup:
+                    await self.cleanup()
+                    next_cleanup = loop.time() + CLEANUP_INTERVAL
+            except asyncio.CancelledError:
+                raise
+            except asyncpg.UndefinedTableError:
+                self.counters["errors"] += 1
+                _logger.error(f"Tabla '{OUTBOX_TABLE}' inexistente (¿falta python -m services.migrate?)")
+            except Exception as e:
+                # DB caída: las filas siguen en la tabla, se reintenta en el próximo ciclo
+                self.counters["errors"] += 1
+                _logger.error(f"Error leyendo pendientes: {e}")
+
+    async def process_due(self) -> int:
+        """Toma las filas vencidas (hasta llenar max_inflight) y las intenta en background."""
+        free = self.max_inflight - len(self._inflight)
+        if free <= 0 or self.pool is None:
+            return 0
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(CLAIM_SQL, free, LEASE_SECONDS)
+        for row in rows:
+            self._spawn(row)
+        # se llenó el cupo: puede haber más vencidas
+        self._backlog = len(rows) >= free
+        return len(rows)
+
+    async def _attempt(self, row):
+        mac, attempts = row["client_mac"], row["attempts"]
+        try:
+            ok = await unifi_guest_approve_async(mac, row["ap_mac"] or None, row["ssid"] or None)
+            error = None if ok else "el controlador no autorizó (o no respondió)"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        if ok:
+            result, sql, args = "ok", f"""
+                UPDATE {OUTBOX_TABLE}
+                SET status = 'done', last_error = NULL, updated_at = NOW()
+                WHERE id = $1 AND status = 'pending'
+            """, (row["id"],)
+        elif attempts >= self.max_attempts:
+            result, sql, args = "failed", f"""
+                UPDATE {OUTBOX_TABLE}
+                SET status = 'failed', last_error = $2, updated_at = NOW()
+                WHERE id = $1 AND status = 'pending'
+            """, (row["id"], error)
+        else:
+            delay = backoff(attempts)
+            result, sql, args = "retry", f"""
+                UPDATE {OUTBOX_TABLE}
+                SET next_attempt_at = NOW() + make_interval(secs => $3), last_error = $2, updated_at = NOW()
+                WHERE id = $1 AND status = 'pending'
+            """, (row["id"], error, delay)
+
+        self.counters[result] += 1
+        OUTBOX_ATTEMPTS.inc(result)
+        if result == "ok":
+            _logger.info(f"MAC={mac} autorizada (intento {attempts})")
+        elif result == "failed":
+            _logger.error(f"MAC={mac} abandonada tras {attempts} intentos: {error}")
+        else:
+            _logger.error(f"MAC={mac} intento {attempts} falló → reintento en {delay:.1f}s")
+
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(sql, *args)
+        except Exception as e:
+            # sin marcar: al vencer el lease se vuelve a intentar (autorizar dos veces no daña)
+            self.counters["errors"] += 1
+            _logger.error(f"No se pudo actualizar la fila {row['id']}: {e}")
+
+    async def cleanup(self) -> int:
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(f"""
+                DELETE FROM {OUTBOX_TABLE}
+                WHERE status <> 'pending' AND updated_at < NOW() - make_interval(days => $1)
+            """, KEEP_DAYS)
+        return int(status.split()[-1])
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._inflight),
+            "max_inflight": self.max_inflight,
+            "counters": dict(self.counters),
+        }
+
+
+auth_outbox = AuthOutbox()
@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+import configparser
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
+
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# Fallas seguidas (errores, 5xx o llamadas lentas) que abren el circuito
+BREAKER_FAILURES = int(config["Unifi"].get("breaker_failures", "5"))
+# Una llamada más lenta que esto cuenta como falla
+BREAKER_SLOW_MS = int(config["Unifi"].get("breaker_slow_ms", "2000"))
+# Tiempo abierto antes de dejar pasar una llamada de prueba (half-open)
+BREAKER_OPEN_SECONDS = float(config["Unifi"].get("breaker_open_seconds", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# ------------------------------------------------------
+# CIRCUIT BREAKER POR CONTROLADOR
+# ------------------------------------------------------
+class CircuitBreaker:
+    """closed → open (N fallas) → half_open (1 prueba) → closed / open."""
+
+    def __init__(
+        self,
+        name,
+        max_failures=BREAKER_FAILURES,
+        slow_ms=BREAKER_SLOW_MS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.max_failures = max_failures
+        self.slow_s = slow_ms / 1000
+        self.open_seconds = open_seconds
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.fast_fails = 0
+        self.last_error = None
+        self._probe = False
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True mientras el circuito esté abierto y no toque probar (fast-fail)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds:
+                self.fast_fails += 1
+                return True
+            return False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.fast_fails += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probe = False
+
+            # HALF_OPEN: una sola llamada de prueba a la vez. Si la prueba no volvió
+            # en open_seconds (se perdió sin record()) se deja pasar otra.
+            if self._probe and time.monotonic() - self._probe_at < self.open_seconds:
+                self.fast_fails += 1
+                return False
+            self._probe = True
+            self._probe_at = time.monotonic()
+            return True
+
+    def record(self, ok: bool, elapsed: float | None = None, error: str | None = None):
+        if ok and elapsed is not None and elapsed > self.slow_s:
+            ok = False
+            error = f"lenta ({elapsed*1000:.0f} ms)"
+
+        with self._lock:
+            self._probe = False
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                return
+
+            self.failures += 1
+            self.last_error = error
+            if self.state == HALF_OPEN or self.failures >= self.max_failures:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_failure(self, error: str | None = None):
+        self.record(False, error=error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "fast_fails": self.fast_fails,
+                "retry_in_s": round(retry_in, 1),
+                "last_error": self.last_error,
+            }
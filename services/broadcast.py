@@ -0,0 +1,50 @@
+import os
+import time
+
+from services.session_store import SESSION_DIR
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+# Archivo que cambia en cada revocación (mismo directorio compartido que las sesiones UniFi)
+REVOCATIONS_PATH = os.path.join(SESSION_DIR, "revocations")
+
+
+# ------------------------------------------------------
+# INVALIDACIONES ENTRE WORKERS (generación en archivo)
+# ------------------------------------------------------
+class SharedGeneration:
+    """
+    Contador de generación compartido por todos los workers de gunicorn: bump()
+    reemplaza el archivo (inodo nuevo) y cada instancia ve el cambio con un
+    stat en changed(). Las caches en memoria lo usan para vaciarse cuando otro
+    worker revoca una MAC.
+    """
+
+    def __init__(self, path=REVOCATIONS_PATH):
+        self.path = path
+        self._seen = self._stamp()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def bump(self):
+        """Avisa a todos los workers (este incluido, en su próximo changed())."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f"{time.time_ns()} {os.getpid()}\n")
+        os.replace(tmp, self.path)
+
+    def changed(self) -> bool:
+        """True una vez por cada bump() posterior a la última llamada."""
+        stamp = self._stamp()
+        if stamp == self._seen:
+            return False
+        self._seen = stamp
+        return True
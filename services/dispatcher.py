@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import deque
+
+from services.unifi import config, log_error
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+MAX_CONCURRENCY = int(config["Unifi"].get("max_concurrency", "4"))
+MAX_QUEUE = int(config["Unifi"].get("max_queue", "200"))
+AUTH_DEADLINE = float(config["Unifi"].get("auth_deadline", "10"))
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    idx = min(len(orden) - 1, int(round(p / 100 * (len(orden) - 1))))
+    return orden[idx]
+
+
+# ------------------------------------------------------
+# DISPATCHER DE AUTORIZACIONES
+# ------------------------------------------------------
+class AuthDispatcher:
+    """
+    Autorizaciones con concurrencia acotada por controlador, límite de cola,
+    deadline por request y coalescencia de pedidos duplicados de la misma MAC.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, deadline=AUTH_DEADLINE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+
+        self._sems: dict[tuple, asyncio.Semaphore] = {}
+        self._waiting: dict[tuple, int] = {}
+        self._running: dict[tuple, int] = {}
+        self._inflight: dict[tuple, asyncio.Task] = {}
+
+        self.counters = {
+            "submitted": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "ok": 0,
+            "failed": 0,
+        }
+        self._latency = deque(maxlen=1000)
+        self._queue_wait = deque(maxlen=1000)
+
+    def _sem(self, key):
+        sem = self._sems.get(key)
+        if sem is None:
+            sem = asyncio.Semaphore(self.max_concurrency)
+            self._sems[key] = sem
+        return sem
+
+    async def submit(self, controller, site, mac, minutes, deadline=None) -> bool:
+        """Encola la autorización; devuelve True/False como unifi_guest_approve."""
+        deadline = self.deadline if deadline is None else deadline
+        key = controller.key
+        req_key = (key, site, mac.lower())
+        self.counters["submitted"] += 1
+
+        task = self._inflight.get(req_key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            if self._waiting.get(key, 0) >= self.max_queue:
+                self.counters["rejected"] += 1
+                log_error(f"[DISPATCH] Cola llena ({self.max_queue}) → MAC={mac} rechazada")
+                return False
+
+            # se cuenta en cola ya al encolar, así una ráfaga no supera max_queue
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            task = asyncio.create_task(self._run(controller, site, mac, minutes, deadline))
+            self._inflight[req_key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(req_key, None))
+
+        # shield: si un pedido duplicado se cancela no cancela al resto
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            log_error(f"[DISPATCH] Error autorizando MAC={mac}: {e}")
+            return False
+
+    async def _run(self, controller, site, mac, minutes, deadline):
+        t0 = time.monotonic()
+        try:
+            ok = await asyncio.wait_for(self._execute(controller, site, mac, minutes, t0), timeout=deadline)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            log_error(f"[DISPATCH] Deadline {deadline}s vencido → MAC={mac}")
+            return False
+
+        self._latency.append(time.monotonic() - t0)
+        self.counters["ok" if ok else "failed"] += 1
+        return ok
+
+    async def _execute(self, controller, site, mac, minutes, t0):
+        key = controller.key
+        try:
+            await self._sem(key).acquire()
+        finally:
+            self._waiting[key] -= 1
+
+        self._queue_wait.append(time.monotonic() - t0)
+        self._running[key] = self._running.get(key, 0) + 1
+        try:
+            return await controller.guest_approve(site, mac, minutes)
+        finally:
+            self._running[key] -= 1
+            self._sems[key].release()
+
+    def stats(self) -> dict:
+        lat = list(self._latency)
+        wait = list(self._queue_wait)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "deadline": self.deadline,
+            "inflight": len(self._inflight),
+            "controllers": {
+                f"{k[0]} (modelo {k[2]})": {
+                    "waiting": self._waiting.get(k, 0),
+                    "running": self._running.get(k, 0),
+                }
+                for k in self._sems
+            },
+            "counters": dict(self.counters),
+            "latency_ms": {
+                "p50": round(_percentil(lat, 50) * 1000, 1),
+                "p95": round(_percentil(lat, 95) * 1000, 1),
+                "max": round(max(lat, default=0) * 1000, 1),
+            },
+            "queue_wait_ms": {
+                "p50": round(_percentil(wait, 50) * 1000, 1),
+                "p95": round(_percentil(wait, 95) * 1000, 1),
+                "max": round(max(wait, default=0) * 1000, 1),
+            },
+        }
+
+
+dispatcher = AuthDispatcher()
@@ -1,8 +1,11 @@
-from database import safe_export_and_cleanup
+from database import safe_export_and_cleanup, close_sync_pool
 
 
 def main():
-    path = safe_export_and_cleanup()
+    try:
+        path = safe_export_and_cleanup()
+    finally:
+        close_sync_pool()
     if path:
         print(f"🟢 Exportación correcta → {path}")
     else:
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+
+from database import config
+from services.broadcast import SharedGeneration
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+# Días desde el último registro en que una MAC conocida entra sin formulario (0 = siempre formulario)
+RETURNING_GUEST_DAYS = float(config["Redirect"].get("returning_guest_days", "7"))
+# Segundos que se recuerda la respuesta de la DB para una MAC (conocida o no)
+KNOWN_DEVICE_TTL = float(config["Redirect"].get("known_device_cache_seconds", "60"))
+KNOWN_DEVICE_CACHE_SIZE = int(config["Redirect"].get("known_device_cache_size", "10000"))
+
+
+# ------------------------------------------------------
+# CACHE DE EQUIPOS YA REGISTRADOS (TTL + LRU)
+# ------------------------------------------------------
+class KnownDeviceCache:
+    """
+    MAC → ¿registrada dentro de la ventana? Evita ir a la DB en cada GET / del captive browser.
+    Con `shared`, una revocación en otro worker vacía la cache (se vuelve a consultar la DB).
+    """
+
+    def __init__(self, max_size=KNOWN_DEVICE_CACHE_SIZE, ttl=KNOWN_DEVICE_TTL, shared=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared: SharedGeneration | None = shared
+        self._data: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mac) -> bool | None:
+        """True / False si está en cache y vigente; None si hay que consultar la DB."""
+        if self.shared is not None and self.shared.changed():
+            self._data.clear()
+        key = mac.lower()
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, mac, known: bool):
+        if self.ttl <= 0:
+            return
+        key = mac.lower()
+        self._data[key] = (time.monotonic() + self.ttl, known)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+known_devices = KnownDeviceCache(shared=SharedGeneration())
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import configparser
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+    WatchedFileHandler,
+)
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
+
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+DEBUG_MODE = config.get("Admin", "debug", fallback="no").lower() == "yes"
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+LOG_FILE = os.path.join(LOG_DIR, "log.txt")
+
+# size → rota al llegar a log_max_mb | daily → rota a medianoche | external → logrotate
+# Con varios workers (WEB_CONCURRENCY > 1) siempre external: si cada proceso rotara
+# por su cuenta renombraría el archivo debajo de los otros y se perderían líneas
+LOG_ROTATE = config.get("Admin", "log_rotate", fallback="size").lower()
+if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    LOG_ROTATE = "external"
+LOG_MAX_MB = float(config.get("Admin", "log_max_mb", fallback="10"))
+LOG_BACKUPS = int(config.get("Admin", "log_backups", fallback="5"))
+LOG_JSON = config.get("Admin", "log_json", fallback="no").lower() == "yes"
+# Mensajes en cola como máximo; si se llena se descartan (nunca se bloquea)
+LOG_QUEUE_SIZE = 10000
+
+
+# ------------------------------------------------------
+# FORMATOS
+# ------------------------------------------------------
+def _tag(record):
+    # "portal.unifi" → "[UNIFI] ", "portal" → ""
+    parts = record.name.split(".", 1)
+    return f"[{parts[1].upper()}] " if len(parts) > 1 else ""
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        ts = self.formatTime(record, "%Y-%m-%d %H:%M:%S")
+        return f"[{ts}] {_tag(record)}{record.levelname}: {record.getMessage()}"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(
+            {
+                "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            },
+            ensure_ascii=False,
+        )
+
+
+# ------------------------------------------------------
+# COLA + THREAD ESCRITOR
+# ------------------------------------------------------
+class DroppingQueueHandler(QueueHandler):
+    """put_nowait; si la cola está llena se descarta y se cuenta."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener: QueueListener | None = None
+
+
+def _build_handlers():
+    fmt = JsonFormatter() if LOG_JSON else TextFormatter()
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(fmt)
+    handlers = [stream]
+
+    # Igual que antes: archivo solo con debug = yes
+    if DEBUG_MODE:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        if LOG_ROTATE == "external":
+            # reabre el archivo cuando logrotate lo mueve; todos los workers escriben con O_APPEND
+            fh = WatchedFileHandler(LOG_FILE, encoding="utf-8")
+        elif LOG_ROTATE == "daily":
+            fh = TimedRotatingFileHandler(
+                LOG_FILE, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8"
+            )
+        else:
+            fh = RotatingFileHandler(
+                LOG_FILE,
+                maxBytes=int(LOG_MAX_MB * 1024 * 1024),
+                backupCount=LOG_BACKUPS,
+                encoding="utf-8",
+            )
+        fh.setFormatter(fmt)
+        handlers.append(fh)
+
+    return handlers
+
+
+def setup_logging():
+    """Logger 'portal': los handlers de stdout/archivo corren en un thread aparte."""
+    global _listener
+    if _listener is not None:
+        return
+
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger("portal")
+    root.setLevel(logging.INFO)
+    root.propagate = False
+    root.handlers.clear()
+    root.addHandler(DroppingQueueHandler(q))
+
+    _listener = QueueListener(q, *_build_handlers(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Vacía la cola y cierra archivos (al salir del proceso)."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for h in _listener.handlers:
+        h.close()
+    _listener = None
+
+
+def get_logger(name="portal") -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+
+from services.broadcast import SharedGeneration
+from services.unifi import config
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+AUTH_CACHE_SIZE = int(config["Unifi"].get("auth_cache_size", "10000"))
+# Segundos antes del vencimiento real en el controlador en que la entrada deja de valer
+AUTH_CACHE_MARGIN = int(config["Unifi"].get("auth_cache_margin", "60"))
+
+
+# ------------------------------------------------------
+# CACHE DE MACS AUTORIZADAS (TTL + LRU)
+# ------------------------------------------------------
+class AuthorizedMacCache:
+    """
+    MACs autorizadas recientemente por (controlador, site); vencen con session_minutes.
+    Con `shared`, una revocación en cualquier worker vacía la cache de todos.
+    """
+
+    def __init__(self, max_size=AUTH_CACHE_SIZE, margin=AUTH_CACHE_MARGIN, shared=None):
+        self.max_size = max_size
+        self.margin = margin
+        self.shared: SharedGeneration | None = shared
+        self._data: OrderedDict[tuple, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(ctrl, site, mac):
+        return (ctrl, site, mac.lower())
+
+    def is_authorized(self, ctrl, site, mac) -> bool:
+        if self.shared is not None and self.shared.changed():
+            self._data.clear()
+        key = self._key(ctrl, site, mac)
+        expires = self._data.get(key)
+        if expires is None:
+            self.misses += 1
+            return False
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return False
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, ctrl, site, mac, minutes):
+        ttl = minutes * 60 - self.margin
+        if ttl <= 0:
+            return
+        key = self._key(ctrl, site, mac)
+        self._data[key] = time.monotonic() + ttl
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, ctrl, site, mac):
+        """Revocación explícita (admin): la próxima aprobación va al controlador (en todos los workers)."""
+        found = self._data.pop(self._key(ctrl, site, mac), None) is not None
+        if self.shared is not None:
+            self.shared.bump()
+        return found
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+mac_cache = AuthorizedMacCache(shared=SharedGeneration())
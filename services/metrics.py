@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import bisect
+import asyncio
+import threading
+import configparser
+from contextlib import contextmanager
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
+
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# Con varios workers de gunicorn (WEB_CONCURRENCY > 1) cada uno vuelca sus valores
+# en metrics_dir cada metrics_snapshot_seconds y /metrics suma los de todos
+MULTIPROCESS = int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+METRICS_DIR = config["Admin"].get("metrics_dir", "spool/metrics")
+if not os.path.isabs(METRICS_DIR):
+    METRICS_DIR = os.path.join(BASE_DIR, METRICS_DIR)
+SNAPSHOT_SECONDS = float(config["Admin"].get("metrics_snapshot_seconds", "5"))
+
+
+# ------------------------------------------------------
+# MÉTRICAS EN FORMATO PROMETHEUS (sin dependencias)
+# ------------------------------------------------------
+# Contadores / histogramas en memoria del proceso; los gauges se calculan al
+# momento del scrape con callbacks, así el camino caliente solo suma números.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry: list = []
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in pairs
+    )
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(parts) -> dict:
+        total = {}
+        for values in parts:
+            for lv, v in values.items():
+                total[lv] = total.get(lv, 0) + v
+        return total
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for lv, v in values.items():
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {v}"
+
+
+class Histogram:
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        # label_values → [conteo por bucket..., +Inf, suma]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds, *label_values):
+        idx = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = [0] * (len(self.buckets) + 2)
+                self._values[label_values] = data
+            data[idx] += 1
+            data[-1] += seconds
+
+    @contextmanager
+    def time(self, *label_values):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {lv: list(d) for lv, d in self._values.items()}
+
+    @staticmethod
+    def merge(parts) -> dict:
+        total = {}
+        for values in parts:
+            for lv, data in values.items():
+                acc = total.get(lv)
+                total[lv] = list(data) if acc is None else [a + b for a, b in zip(acc, data)]
+        return total
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for lv, data in values.items():
+            acc = 0
+            for bound, n in zip(self.buckets, data):
+                acc += n
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, lv, ('le', bound))} {acc}"
+            acc += data[len(self.buckets)]
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, lv, ('le', '+Inf'))} {acc}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, lv)} {data[-1]}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, lv)} {acc}"
+
+
+class Gauge:
+    """
+    El valor sale de fn() al hacer scrape: fn devuelve número o {labels_tuple: número}.
+    Entre workers se suma (aggregate="sum") o se toma el mayor ("max", p. ej. estados).
+    """
+
+    def __init__(self, name, doc, fn, labels=(), aggregate="sum"):
+        self.name, self.doc, self.fn, self.labels = name, doc, fn, tuple(labels)
+        self.aggregate = aggregate
+        _registry.append(self)
+
+    def snapshot(self) -> dict | None:
+        try:
+            value = self.fn()
+        except Exception:
+            return None
+        return dict(value) if isinstance(value, dict) else {(): value}
+
+    def merge(self, parts) -> dict:
+        total = {}
+        for values in parts:
+            for lv, v in values.items():
+                if lv not in total:
+                    total[lv] = v
+                elif self.aggregate == "max":
+                    total[lv] = max(total[lv], v)
+                else:
+                    total[lv] = total[lv] + v
+        return total
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} gauge"
+        for lv, v in values.items():
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {v}"
+
+
+# ------------------------------------------------------
+# SNAPSHOTS POR WORKER (varios procesos → un solo /metrics)
+# ------------------------------------------------------
+def collect_snapshot() -> dict:
+    """Valores actuales de este proceso (en el event loop: los gauges leen estado del loop)."""
+    return {m.name: m.snapshot() for m in _registry}
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics.{pid}.json")
+
+
+def write_snapshot(snapshot: dict):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    data = {
+        name: [[list(lv), v] for lv, v in values.items()]
+        for name, values in snapshot.items()
+        if values is not None
+    }
+    path = _snapshot_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshots(own: dict) -> list[tuple[bool, dict]]:
+    """[(vivo, snapshot)]: el propio fresco y el último volcado de cada otro worker."""
+    snapshots = [(True, own)]
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not (name.startswith("metrics.") and name.endswith(".json")):
+            continue
+        try:
+            pid = int(name.split(".")[1])
+        except ValueError:
+            continue
+        if pid == os.getpid():
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            continue
+        data = {metric: {tuple(lv): v for lv, v in items} for metric, items in raw.items()}
+        snapshots.append((_pid_alive(pid), data))
+    return snapshots
+
+
+def render_metrics(own: dict | None = None) -> str:
+    """
+    Texto para Prometheus. Con MULTIPROCESS suma los volcados de todos los
+    workers: contadores e histogramas también de workers ya muertos (así no
+    retroceden), gauges solo de los vivos. Hace I/O: llamarlo con to_thread.
+    """
+    if own is None:
+        own = collect_snapshot()
+    if MULTIPROCESS:
+        write_snapshot(own)
+        snapshots = _read_snapshots(own)
+    else:
+        snapshots = [(True, own)]
+
+    lines = []
+    for metric in _registry:
+        parts = [
+            snap[metric.name]
+            for alive, snap in snapshots
+            if snap.get(metric.name) is not None and (alive or not isinstance(metric, Gauge))
+        ]
+        if not parts:
+            continue
+        lines.extend(metric.render(metric.merge(parts)))
+    return "\n".join(lines) + "\n"
+
+
+async def run_snapshots(interval=SNAPSHOT_SECONDS):
+    """Vuelca los valores de este worker cada `interval` (y una última vez al cancelarse)."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(write_snapshot, collect_snapshot())
+            except OSError:
+                pass  # el próximo volcado lo reintenta
+    finally:
+        try:
+            write_snapshot(collect_snapshot())
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------
+# MÉTRICAS DEL PORTAL
+# ------------------------------------------------------
+REQUEST_SECONDS = Histogram(
+    "portal_request_seconds", "Latencia de requests HTTP por ruta", ("method", "route", "status")
+)
+DB_INSERT_SECONDS = Histogram(
+    "portal_db_insert_seconds", "Latencia de alta de signup (insert directo o encolado)", ("mode",)
+)
+DB_FLUSH_SECONDS = Histogram(
+    "portal_db_flush_seconds", "Latencia de cada COPY del buffer write-behind"
+)
+DB_ACQUIRE_SECONDS = Histogram(
+    "portal_db_pool_acquire_seconds", "Espera para obtener conexión del pool", ("driver",)
+)
+UNIFI_CALL_SECONDS = Histogram(
+    "portal_unifi_call_seconds", "Latencia de llamadas al controlador", ("modelo", "cmd")
+)
+UNIFI_CALLS = Counter(
+    "portal_unifi_calls_total", "Llamadas al controlador por resultado", ("modelo", "cmd", "result")
+)
+EXPORT_SECONDS = Histogram(
+    "portal_export_seconds", "Duración de safe_export_and_cleanup",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+EXPORTS = Counter("portal_exports_total", "Exports por resultado", ("result",))
+OUTBOX_ATTEMPTS = Counter(
+    "portal_auth_outbox_attempts_total", "Intentos del outbox de autorizaciones por resultado", ("result",)
+)
+RETURNING_GUESTS = Counter(
+    "portal_returning_guest_total", "GET / de MACs ya registradas (sin formulario) por resultado", ("result",)
+)
+SIGNUP_ADMISSION = Counter(
+    "portal_signup_admission_total", "POST / por resultado de admisión", ("result",)
+)
+
+
+# ------------------------------------------------------
+# POOL ASYNCPG CON TIEMPO DE ESPERA MEDIDO
+# ------------------------------------------------------
+class _TimedAcquire:
+    def __init__(self, pool, timeout=None):
+        self._cm = pool.acquire(timeout=timeout)
+
+    async def __aenter__(self):
+        t0 = time.perf_counter()
+        conn = await self._cm.__aenter__()
+        DB_ACQUIRE_SECONDS.observe(time.perf_counter() - t0, "asyncpg")
+        return conn
+
+    async def __aexit__(self, *exc):
+        return await self._cm.__aexit__(*exc)
+
+
+class TimedPool:
+    """Envuelve un asyncpg.Pool: acquire() mide la espera; el resto se delega."""
+
+    def __init__(self, pool, timeout=None):
+        self._pool = pool
+        self.timeout = timeout
+
+    def acquire(self):
+        return _TimedAcquire(self._pool, self.timeout)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+# ------------------------------------------------------
+# MIDDLEWARE ASGI: LATENCIA POR RUTA
+# ------------------------------------------------------
+class MetricsMiddleware:
+    """
+    ASGI puro (sin BaseHTTPMiddleware): mide hasta el último byte del body,
+    así un StreamingResponse cuenta completo. La ruta es el template
+    ("/admin", "/assets/{name}"), no la URL, para no explotar en series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Mounts (/static) no dejan "route" pero sí root_path
+            route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, scope["method"], route, status)
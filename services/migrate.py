@@ -0,0 +1,422 @@
+import os
+import time
+
+import psycopg2
+
+from database import (
+    DB_PARAMS,
+    DAILY_MACS_TABLE,
+    DEVICES_TABLE,
+    GUESTS_TABLE,
+    HOURLY_TABLE,
+    LEGACY_TABLE,
+    OUTBOX_TABLE,
+    TABLE_NAME,
+    VISITS_TABLE,
+    db_connection,
+    close_sync_pool,
+)
+from services.logger import get_logger
+
+_logger = get_logger("portal.migrate")
+
+
+# ------------------------------------------------------
+# 🧱 MIGRACIONES DE ESQUEMA (versionadas)
+# ------------------------------------------------------
+# Cada migración corre una sola vez y queda anotada en schema_migrations.
+# Se aplican con un advisory lock: si arrancan varios workers/contenedores
+# a la vez, uno migra y el resto espera y encuentra todo aplicado.
+# Para cambiar el esquema: agregar una versión nueva al final (nunca editar
+# una ya publicada). Lo que evita aplicar algo dos veces es la tabla de
+# versiones + una transacción por migración (el DDL y el INSERT de la versión
+# se confirman juntos), no el DDL: las 1-3 usan IF NOT EXISTS para adoptar
+# las bases creadas por el db_init() anterior, pero desde la 4 hay CREATE
+# VIEW / FUNCTION y RENAME que fallarían si se repitieran.
+MIGRATIONS_TABLE = "schema_migrations"
+MIGRATION_LOCK_KEY = 727002
+
+MIGRATIONS = [
+    (1, f"tabla {TABLE_NAME} + índices del panel admin", [
+        f"""
+        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+            id SERIAL PRIMARY KEY,
+            fullname VARCHAR(200),
+            email VARCHAR(200),
+            phone VARCHAR(50),
+            client_mac VARCHAR(50),
+            client_ip VARCHAR(50),
+            ap_mac VARCHAR(50),
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        """,
+        f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_created_at_idx ON {TABLE_NAME} (created_at DESC, id DESC)",
+        f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_email_idx ON {TABLE_NAME} (lower(email) text_pattern_ops)",
+        f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_client_mac_idx ON {TABLE_NAME} (lower(client_mac))",
+        f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_ap_mac_idx ON {TABLE_NAME} (lower(ap_mac))",
+    ]),
+    (2, "rollups de estadísticas (por hora/AP y MACs únicas por día)", [
+        f"""
+        CREATE TABLE IF NOT EXISTS {HOURLY_TABLE} (
+            hour TIMESTAMP NOT NULL,
+            ap_mac VARCHAR(50) NOT NULL DEFAULT '',
+            signups INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, ap_mac)
+        );
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS {DAILY_MACS_TABLE} (
+            day DATE NOT NULL,
+            client_mac VARCHAR(50) NOT NULL,
+            PRIMARY KEY (day, client_mac)
+        );
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {TABLE_NAME}_rollup() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO {HOURLY_TABLE} (hour, ap_mac, signups)
+                SELECT date_trunc('hour', COALESCE(created_at, NOW())),
+                       lower(COALESCE(ap_mac, '')),
+                       COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2
+            ON CONFLICT (hour, ap_mac)
+                DO UPDATE SET signups = {HOURLY_TABLE}.signups + EXCLUDED.signups;
+
+            INSERT INTO {DAILY_MACS_TABLE} (day, client_mac)
+                SELECT DISTINCT COALESCE(created_at, NOW())::date, lower(client_mac)
+                FROM new_rows
+                WHERE COALESCE(client_mac, '') <> ''
+            ON CONFLICT DO NOTHING;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE TRIGGER {TABLE_NAME}_rollup_trg
+            AFTER INSERT ON {TABLE_NAME}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION {TABLE_NAME}_rollup();
+        """,
+        # Backfill con lo que ya estaba en la tabla al crear los rollups
+        f"""
+        INSERT INTO {HOURLY_TABLE} (hour, ap_mac, signups)
+            SELECT date_trunc('hour', COALESCE(created_at, NOW())), lower(COALESCE(ap_mac, '')), COUNT(*)
+            FROM {TABLE_NAME}
+            WHERE NOT EXISTS (SELECT 1 FROM {HOURLY_TABLE})
+            GROUP BY 1, 2;
+        """,
+        f"""
+        INSERT INTO {DAILY_MACS_TABLE} (day, client_mac)
+            SELECT DISTINCT COALESCE(created_at, NOW())::date, lower(client_mac)
+            FROM {TABLE_NAME}
+            WHERE COALESCE(client_mac, '') <> ''
+              AND NOT EXISTS (SELECT 1 FROM {DAILY_MACS_TABLE})
+        ON CONFLICT DO NOTHING;
+        """,
+    ]),
+    (3, "tabla errors (log_db_error)", [
+        """
+        CREATE TABLE IF NOT EXISTS errors (
+            id SERIAL PRIMARY KEY,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        """,
+    ]),
+    (4, f"huéspedes únicos (email / MAC) con upsert; {TABLE_NAME} pasa a ser vista", [
+        f"""
+        CREATE TABLE {GUESTS_TABLE} (
+            id SERIAL PRIMARY KEY,
+            fullname VARCHAR(200),
+            email VARCHAR(200) NOT NULL,
+            phone VARCHAR(50),
+            first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+            visit_count INTEGER NOT NULL DEFAULT 1
+        );
+        """,
+        f"CREATE UNIQUE INDEX {GUESTS_TABLE}_email_key ON {GUESTS_TABLE} (lower(email))",
+        f"CREATE INDEX {GUESTS_TABLE}_email_prefix_idx ON {GUESTS_TABLE} (lower(email) text_pattern_ops)",
+        # client_mac en minúsculas; guest_id = último huésped que se registró con ese equipo
+        f"""
+        CREATE TABLE {DEVICES_TABLE} (
+            client_mac VARCHAR(50) PRIMARY KEY,
+            guest_id INTEGER NOT NULL REFERENCES {GUESTS_TABLE} (id),
+            first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+            visit_count INTEGER NOT NULL DEFAULT 1
+        );
+        """,
+        f"""
+        CREATE TABLE {VISITS_TABLE} (
+            id SERIAL PRIMARY KEY,
+            guest_id INTEGER NOT NULL REFERENCES {GUESTS_TABLE} (id),
+            client_mac VARCHAR(50),
+            client_ip VARCHAR(50),
+            ap_mac VARCHAR(50),
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        """,
+        f"CREATE INDEX {VISITS_TABLE}_created_at_idx ON {VISITS_TABLE} (created_at DESC, id DESC)",
+        f"CREATE INDEX {VISITS_TABLE}_guest_id_idx ON {VISITS_TABLE} (guest_id)",
+        f"CREATE INDEX {VISITS_TABLE}_client_mac_idx ON {VISITS_TABLE} (lower(client_mac))",
+        f"CREATE INDEX {VISITS_TABLE}_ap_mac_idx ON {VISITS_TABLE} (lower(ap_mac))",
+        # Backfill desde la tabla append-only (datos del registro más nuevo de cada email / MAC)
+        f"""
+        INSERT INTO {GUESTS_TABLE} (fullname, email, phone, first_seen, last_seen, visit_count)
+            SELECT DISTINCT ON (lower(COALESCE(email, '')))
+                   fullname, COALESCE(email, ''),
+                   COALESCE((array_agg(phone) FILTER (WHERE COALESCE(phone, '') <> '') OVER w)[1], phone),
+                   MIN(COALESCE(created_at, NOW())) OVER w,
+                   MAX(COALESCE(created_at, NOW())) OVER w,
+                   COUNT(*) OVER w
+            FROM {TABLE_NAME}
+            WINDOW w AS (PARTITION BY lower(COALESCE(email, '')) ORDER BY id DESC
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+            ORDER BY lower(COALESCE(email, '')), id DESC;
+        """,
+        f"""
+        INSERT INTO {DEVICES_TABLE} (client_mac, guest_id, first_seen, last_seen, visit_count)
+            SELECT DISTINCT ON (lower(s.client_mac))
+                   lower(s.client_mac), g.id,
+                   MIN(COALESCE(s.created_at, NOW())) OVER w,
+                   MAX(COALESCE(s.created_at, NOW())) OVER w,
+                   COUNT(*) OVER w
+            FROM {TABLE_NAME} s
+            JOIN {GUESTS_TABLE} g ON lower(g.email) = lower(COALESCE(s.email, ''))
+            WHERE COALESCE(s.client_mac, '') <> ''
+            WINDOW w AS (PARTITION BY lower(s.client_mac))
+            ORDER BY lower(s.client_mac), s.id DESC;
+        """,
+        # Mismos id: los CSV ya exportados y los links del admin siguen valiendo
+        f"""
+        INSERT INTO {VISITS_TABLE} (id, guest_id, client_mac, client_ip, ap_mac, created_at)
+            SELECT s.id, g.id, s.client_mac, s.client_ip, s.ap_mac, COALESCE(s.created_at, NOW())
+            FROM {TABLE_NAME} s
+            JOIN {GUESTS_TABLE} g ON lower(g.email) = lower(COALESCE(s.email, ''));
+        """,
+        f"""
+        SELECT setval(pg_get_serial_sequence('{VISITS_TABLE}', 'id'), GREATEST(
+            (SELECT COALESCE(MAX(id), 0) FROM {VISITS_TABLE}),
+            COALESCE(pg_sequence_last_value(pg_get_serial_sequence('{TABLE_NAME}', 'id')::regclass), 0),
+            1
+        ));
+        """,
+        # La tabla vieja queda como respaldo ({TABLE_NAME}_legacy); se puede borrar a mano
+        f"DROP TRIGGER IF EXISTS {TABLE_NAME}_rollup_trg ON {TABLE_NAME}",
+        f"ALTER TABLE {TABLE_NAME} RENAME TO {LEGACY_TABLE}",
+        f"""
+        CREATE VIEW {TABLE_NAME} AS
+            SELECT v.id, g.fullname, g.email, g.phone, v.client_mac, v.client_ip, v.ap_mac, v.created_at
+            FROM {VISITS_TABLE} v
+            JOIN {GUESTS_TABLE} g ON g.id = v.guest_id;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {TABLE_NAME}_upsert() RETURNS trigger AS $$
+        DECLARE
+            ts TIMESTAMP := COALESCE(NEW.created_at, NOW());
+            gid INTEGER;
+        BEGIN
+            INSERT INTO {GUESTS_TABLE} AS g (fullname, email, phone, first_seen, last_seen)
+                VALUES (NEW.fullname, COALESCE(NEW.email, ''), NEW.phone, ts, ts)
+            ON CONFLICT ((lower(email))) DO UPDATE SET
+                fullname = COALESCE(NULLIF(EXCLUDED.fullname, ''), g.fullname),
+                phone = COALESCE(NULLIF(EXCLUDED.phone, ''), g.phone),
+                last_seen = GREATEST(g.last_seen, EXCLUDED.last_seen),
+                visit_count = g.visit_count + 1
+            RETURNING id INTO gid;
+
+            IF COALESCE(NEW.client_mac, '') <> '' THEN
+                INSERT INTO {DEVICES_TABLE} AS d (client_mac, guest_id, first_seen, last_seen)
+                    VALUES (lower(NEW.client_mac), gid, ts, ts)
+                ON CONFLICT (client_mac) DO UPDATE SET
+                    guest_id = EXCLUDED.guest_id,
+                    last_seen = GREATEST(d.last_seen, EXCLUDED.last_seen),
+                    visit_count = d.visit_count + 1;
+            END IF;
+
+            INSERT INTO {VISITS_TABLE} (guest_id, client_mac, client_ip, ap_mac, created_at)
+                VALUES (gid, NEW.client_mac, NEW.client_ip, NEW.ap_mac, ts)
+                RETURNING id INTO NEW.id;
+            NEW.created_at := ts;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        # El export borra visitas; huéspedes y dispositivos quedan
+        f"""
+        CREATE OR REPLACE FUNCTION {TABLE_NAME}_delete() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM {VISITS_TABLE} WHERE id = OLD.id;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE TRIGGER {TABLE_NAME}_upsert_trg
+            INSTEAD OF INSERT ON {TABLE_NAME}
+            FOR EACH ROW EXECUTE FUNCTION {TABLE_NAME}_upsert();
+        """,
+        f"""
+        CREATE TRIGGER {TABLE_NAME}_delete_trg
+            INSTEAD OF DELETE ON {TABLE_NAME}
+            FOR EACH ROW EXECUTE FUNCTION {TABLE_NAME}_delete();
+        """,
+        # Rollups: mismo trigger por sentencia, ahora sobre visitas
+        f"""
+        CREATE OR REPLACE TRIGGER {VISITS_TABLE}_rollup_trg
+            AFTER INSERT ON {VISITS_TABLE}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION {TABLE_NAME}_rollup();
+        """,
+    ]),
+    (5, "outbox de autorizaciones UniFi (reintentos con backoff)", [
+        # status: pending → done | failed; next_attempt_at también hace de lease mientras se intenta
+        f"""
+        CREATE TABLE {OUTBOX_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            client_mac VARCHAR(50) NOT NULL,
+            ap_mac VARCHAR(50),
+            ssid VARCHAR(100),
+            status VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        """,
+        # Una sola autorización pendiente por MAC (el reenvío del formulario la reutiliza)
+        f"""
+        CREATE UNIQUE INDEX {OUTBOX_TABLE}_pending_mac_key
+            ON {OUTBOX_TABLE} (lower(client_mac)) WHERE status = 'pending'
+        """,
+        f"""
+        CREATE INDEX {OUTBOX_TABLE}_due_idx
+            ON {OUTBOX_TABLE} (next_attempt_at) WHERE status = 'pending'
+        """,
+    ]),
+    (6, f"revocación persistente de dispositivos ({DEVICES_TABLE}.revoked_at)", [
+        # Revocado desde el admin: no vuelve a entrar sin formulario hasta un registro posterior
+        f"ALTER TABLE {DEVICES_TABLE} ADD COLUMN revoked_at TIMESTAMP",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def ensure_database():
+    """Crea la base DB_NAME si no existe (conectando a 'postgres'). Solo desde el CLI."""
+    sys_conn = psycopg2.connect(
+        host=DB_PARAMS["host"],
+        port=DB_PARAMS["port"],
+        user=os.getenv("POSTGRES_USER", DB_PARAMS["user"]),
+        password=os.getenv("POSTGRES_PASSWORD", DB_PARAMS["password"]),
+        dbname="postgres",
+    )
+    try:
+        sys_conn.autocommit = True
+        cur = sys_conn.cursor()
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (DB_PARAMS["dbname"],))
+        if not cur.fetchone():
+            cur.execute(f'CREATE DATABASE "{DB_PARAMS["dbname"]}"')
+            _logger.info("🟢 Base de datos creada.")
+        cur.close()
+    finally:
+        sys_conn.close()
+
+
+def schema_version() -> int:
+    """Versión aplicada (0 si nunca se migró). Solo lectura: es lo que corre al arrancar."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT COALESCE(MAX(version), 0) FROM {MIGRATIONS_TABLE}")
+            return cur.fetchone()[0]
+        except psycopg2.errors.UndefinedTable:
+            return 0
+        finally:
+            cur.close()
+            conn.rollback()
+
+
+def migrate() -> list[int]:
+    """Aplica las migraciones pendientes (una transacción por versión). Devuelve las aplicadas."""
+    applied = []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # lock de sesión: bloquea hasta que termine otro proceso que esté migrando
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                );
+            """)
+            cur.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+            done = {row[0] for row in cur.fetchall()}
+            conn.commit()
+
+            for version, description, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                t0 = time.monotonic()
+                try:
+                    for stmt in statements:
+                        cur.execute(stmt)
+                    cur.execute(
+                        f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (%s, %s)",
+                        (version, description),
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    _logger.error(f"❌ Migración {version} ({description}) falló")
+                    raise
+                applied.append(version)
+                _logger.info(f"🟢 Migración {version}: {description} ({time.monotonic() - t0:.2f}s)")
+        finally:
+            # si falló algo, que el error original no quede tapado por el unlock
+            try:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+                cur.close()
+            except psycopg2.Error as e:
+                # cerrar la sesión suelta el lock en el server; db_connection la descarta
+                _logger.warning(f"⚠️ No se pudo liberar el lock de migraciones: {e}")
+                conn.close()
+    return applied
+
+
+def ensure_schema() -> int:
+    """
+    Para el arranque de cada worker: un SELECT y listo si el esquema está al
+    día; solo si falta algo migra (con el lock). Devuelve la versión final.
+    """
+    version = schema_version()
+    if version >= LATEST_VERSION:
+        return version
+    _logger.info(f"🧱 Esquema en versión {version}, migrando a {LATEST_VERSION}")
+    migrate()
+    return LATEST_VERSION
+
+
+def main():
+    try:
+        ensure_database()
+        applied = migrate()
+        if applied:
+            _logger.info(f"🟢 Esquema en versión {LATEST_VERSION} (aplicadas: {applied})")
+        else:
+            _logger.info(f"🟢 Esquema al día (versión {LATEST_VERSION})")
+    finally:
+        close_sync_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from typing import NamedTuple
+
+from services.unifi import config, log_info, log_error
+
+
+# ------------------------------------------------------
+# RUTEO AP → CONTROLADOR / SITE / MODELO
+# ------------------------------------------------------
+# [Unifi]            → ruta por defecto (APs no listados)
+# [Unifi:<nombre>]   → un controlador/site extra con sus APs en `ap_macs`
+#                      (las claves que falten se heredan de [Unifi])
+ROUTE_PREFIX = "Unifi:"
+
+
+class Route(NamedTuple):
+    name: str
+    ctrl: str
+    site: str
+    user: str
+    pwd: str
+    modelo: int
+    minutes: int
+
+
+def normalize_mac(mac: str | None) -> str:
+    return (mac or "").strip().lower().replace("-", ":")
+
+
+def _route_from_section(name, section, base) -> Route:
+    def get(key, default=None):
+        return section.get(key, base.get(key, default))
+
+    return Route(
+        name=name,
+        ctrl=get("controller").rstrip("/"),
+        site=get("site", "default"),
+        user=get("username"),
+        pwd=get("password"),
+        modelo=int(get("modelo", "4")),
+        minutes=int(get("session_minutes", "360")),
+    )
+
+
+def build_routes(cfg):
+    """Precalcula {ap_mac: Route} para que cada lookup sea O(1)."""
+    base = cfg["Unifi"]
+    default = _route_from_section("default", base, base)
+    routes: dict[str, Route] = {}
+
+    for section_name in cfg.sections():
+        if not section_name.startswith(ROUTE_PREFIX):
+            continue
+        name = section_name[len(ROUTE_PREFIX):].strip()
+        section = cfg[section_name]
+        try:
+            route = _route_from_section(name, section, base)
+        except Exception as e:
+            log_error(f"[ROUTING] Sección [{section_name}] inválida: {e}")
+            continue
+
+        for ap in section.get("ap_macs", "").split(","):
+            ap = normalize_mac(ap)
+            if not ap:
+                continue
+            if ap in routes:
+                log_error(f"[ROUTING] AP {ap} repetido ({routes[ap].name} / {name}), se usa {name}")
+            routes[ap] = route
+
+    return default, routes
+
+
+DEFAULT_ROUTE, ROUTES = build_routes(config)
+if ROUTES:
+    log_info(f"[ROUTING] {len(ROUTES)} APs ruteados a {len({r.name for r in ROUTES.values()})} controladores/sites")
+
+
+def resolve_route(ap_mac: str | None) -> Route:
+    return ROUTES.get(normalize_mac(ap_mac), DEFAULT_ROUTE)
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import hashlib
+import configparser
+
+from services.dispatcher import AUTH_DEADLINE
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
+
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+SESSION_DIR = config["Unifi"].get("session_dir", "spool/unifi")
+if not os.path.isabs(SESSION_DIR):
+    SESSION_DIR = os.path.join(BASE_DIR, SESSION_DIR)
+# Máximo (segundos) que un worker espera a que otro termine de loguearse. Tope: la mitad
+# de auth_deadline, para que después de esperar quede tiempo de loguearse y autorizar
+LOGIN_LOCK_TIMEOUT = min(float(config["Unifi"].get("login_lock_timeout", "5")), AUTH_DEADLINE / 2)
+
+
+# ------------------------------------------------------
+# SESIONES DE CONTROLADOR COMPARTIDAS ENTRE WORKERS
+# ------------------------------------------------------
+class SessionStore:
+    """
+    Un archivo JSON por controlador con el CSRF y las cookies del último
+    login, más un .lock con flock para que un solo proceso haga login a la
+    vez: los demás esperan y reutilizan la sesión que quedó guardada.
+    """
+
+    def __init__(self, directory=SESSION_DIR, lock_timeout=LOGIN_LOCK_TIMEOUT):
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        # path → (mtime_ns, datos) para no releer el archivo si no cambió
+        self._cache: dict[str, tuple[int, dict | None]] = {}
+
+    def _path(self, key, ext):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}.{ext}")
+
+    # ---------- lectura / escritura ----------
+    def load(self, key) -> dict | None:
+        """{"csrf", "cookies", "updated"} o None. Un stat por llamada si no cambió."""
+        path = self._path(key, "json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        self._cache[path] = (mtime, data)
+        return data
+
+    def save(self, key, csrf, cookies: dict) -> float:
+        """Guarda la sesión (escritura atómica). Devuelve el timestamp "updated"."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key, "json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        data = {"csrf": csrf, "cookies": cookies, "updated": time.time()}
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, path)
+        return data["updated"]
+
+    def clear(self, key, csrf=None):
+        """Borra la sesión guardada (solo si sigue siendo `csrf`, si se pasa)."""
+        data = self.load(key)
+        if data is None or (csrf is not None and data.get("csrf") != csrf):
+            return
+        try:
+            os.remove(self._path(key, "json"))
+        except FileNotFoundError:
+            pass
+
+    # ---------- lock de login entre procesos ----------
+    async def acquire_login_lock(self, key):
+        """fd con flock exclusivo, o None si pasó lock_timeout (se sigue sin lock)."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self._path(key, "lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        deadline = time.monotonic() + self.lock_timeout
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except OSError:
+                    if time.monotonic() > deadline:
+                        os.close(fd)
+                        return None
+                    await asyncio.sleep(0.05)
+        except BaseException:
+            # cancelado esperando (deadline del dispatcher, shutdown): no dejar el fd abierto
+            os.close(fd)
+            raise
+
+    @staticmethod
+    def release_login_lock(fd):
+        if fd is None:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+session_store = SessionStore()
@@ -0,0 +1,449 @@
+import asyncio
+import fcntl
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+import asyncpg
+
+from database import BASE_DIR, TABLE_NAME, clean_signup, config, track_inserts
+from services.logger import get_logger
+from services.metrics import DB_FLUSH_SECONDS
+
+_logger = get_logger("portal.buffer")
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+WRITE_BEHIND = config["Database"].get("write_behind", "yes").lower() == "yes"
+BATCH_SIZE = int(config["Database"].get("buffer_batch_size", "200"))
+FLUSH_INTERVAL = float(config["Database"].get("buffer_flush_interval", "1"))
+SPOOL_DIR = config["Database"].get("spool_dir", "spool")
+if not os.path.isabs(SPOOL_DIR):
+    SPOOL_DIR = os.path.join(BASE_DIR, SPOOL_DIR)
+
+COLUMNS = ["fullname", "email", "phone", "client_mac", "client_ip", "ap_mac", "created_at"]
+# Filas que la tabla rechaza (largo, encoding…): se apartan acá para que la cola siga
+REJECTED_FILE = "rejected_signups.jsonl"
+# Errores de una fila puntual (no de la DB): el lote se parte para aislarla
+ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+# Filas ya insertadas que se toleran al principio del spool antes de compactarlo
+# (solo pasa si el buffer nunca llega a vaciarse; al vaciarse el spool se trunca)
+SPOOL_COMPACT_ROWS = 10000
+# created_at se guarda en UTC (aware) y lo pasa a TIMESTAMP la misma DB, con la
+# TimeZone de la sesión: igual que NOW() en revoked_at y en los inserts directos
+DB_TIMESTAMPS_SQL = (
+    "SELECT t.ts::timestamp FROM unnest($1::timestamptz[]) WITH ORDINALITY AS t(ts, n) ORDER BY t.n"
+)
+
+
+def _arrival(row: dict) -> datetime:
+    ts = datetime.fromisoformat(row["created_at"])
+    # spools viejos: hora local del app, sin zona
+    return ts if ts.tzinfo is not None else ts.astimezone()
+
+
+def _to_record(row: dict, created_at: datetime) -> tuple:
+    return (
+        row["fullname"],
+        row["email"],
+        row.get("phone", ""),
+        row.get("client_mac", ""),
+        row.get("client_ip", ""),
+        row.get("ap_mac", ""),
+        created_at,
+    )
+
+
+def _resolve(future: asyncio.Future, error: Exception | None):
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+        # el POST que esperaba pudo haberse ido: que no quede como excepción sin leer
+        future.exception()
+
+
+# ------------------------------------------------------
+# ✍️ ESCRITOR DEL SPOOL (thread propio, fsync por grupo)
+# ------------------------------------------------------
+class SpoolWriter:
+    """
+    Único dueño del archivo de spool. Las operaciones se encolan desde el
+    event loop y un thread las aplica en orden: todo lo que llegó mientras
+    se hacía el fsync anterior se escribe junto y se confirma con un solo
+    fsync. El archivo es append-only: filas, checkpoints {"_flushed": n}
+    (las n primeras ya están en la DB) y truncate cuando no queda nada.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._file = None
+        self.fsyncs = 0
+
+    def start(self):
+        self._file = open(self.path, "ab")
+        self._thread = threading.Thread(target=self._loop, name="signup-spool", daemon=True)
+        self._thread.start()
+
+    def submit(self, op, arg=None) -> asyncio.Future:
+        """Encola (el orden de llamada es el orden en disco); el future se resuelve tras el fsync."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((op, arg, loop, future))
+        return future
+
+    async def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+        self._file.close()
+
+    def _apply(self, op, arg):
+        if op == "append":
+            self._file.write((json.dumps(arg, ensure_ascii=False) + "\n").encode("utf-8"))
+        elif op == "checkpoint":
+            self._file.write((json.dumps({"_flushed": arg}) + "\n").encode("utf-8"))
+        elif op == "truncate":
+            self._file.flush()
+            self._file.truncate(0)
+        elif op == "rewrite":
+            # compactar: solo las filas pendientes (escritura atómica)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                for row in arg:
+                    f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._file.close()
+            self._file = open(self.path, "ab")
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            ops = [item for item in batch if item is not None]
+
+            error = None
+            try:
+                for op, arg, _, _ in ops:
+                    self._apply(op, arg)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.fsyncs += 1
+            except Exception as e:
+                error = e
+            for _, _, loop, future in ops:
+                loop.call_soon_threadsafe(_resolve, future, error)
+
+            if len(ops) < len(batch):
+                return
+
+
+# ------------------------------------------------------
+# 🧺 BUFFER WRITE-BEHIND DE SIGNUPS
+# ------------------------------------------------------
+class SignupBuffer:
+    """
+    Junta signups en memoria y los inserta por lotes con COPY (por tamaño o
+    intervalo). Cada fila se escribe antes en un spool en disco (SpoolWriter,
+    fuera del event loop), así un crash no pierde lo que estaba en el buffer:
+    al arrancar se re-inserta.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL, spool_dir=SPOOL_DIR):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_dir = spool_dir
+
+        self.pool: asyncpg.Pool | None = None
+        self._rows: list[dict] = []
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self._lock_fd = None
+        self._writer: SpoolWriter | None = None
+        # filas del principio del spool que ya están en la DB (se anotan con checkpoint)
+        self._spool_flushed = 0
+        self.spool_path = None
+
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.errors = 0
+        self.rejected = 0
+
+    # ---------- spool en disco ----------
+    def _claim_spool(self):
+        """Toma un slot de spool libre (uno por worker) con flock."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        for slot in range(64):
+            lock_path = os.path.join(self.spool_dir, f"signups.{slot}.lock")
+            fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            self._lock_fd = fd
+            self.spool_path = os.path.join(self.spool_dir, f"signups.{slot}.jsonl")
+            return
+        raise RuntimeError(f"Sin slots de spool libres en {self.spool_dir}")
+
+    @staticmethod
+    def _read_spool(path) -> list[dict]:
+        """Filas del spool que siguen sin insertar (después del último checkpoint)."""
+        rows, flushed = [], 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    _logger.warning(f"⚠️ Línea de spool corrupta descartada: {line[:200]}")
+                    continue
+                if "_flushed" in data:
+                    flushed = data["_flushed"]
+                else:
+                    rows.append(data)
+        return rows[flushed:]
+
+    def _recover_spools(self) -> tuple[list[dict], list[tuple[str, int]]]:
+        """
+        Pendientes del spool propio y de todo slot sin worker (flock libre),
+        p. ej. si se reinició con menos workers. Devuelve (filas, [(spool, fd)])
+        con los lock de esos slots tomados hasta que las filas pasen al propio.
+        """
+        rows, orphans = [], []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not (name.startswith("signups.") and name.endswith(".jsonl")):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            if path != self.spool_path:
+                fd = os.open(path[: -len(".jsonl")] + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # slot de un worker vivo: lo recupera él
+                    os.close(fd)
+                    continue
+                orphans.append((path, fd))
+            recovered = self._read_spool(path)
+            if recovered:
+                _logger.info(f"🧺 {len(recovered)} signups recuperados del spool {path}")
+            rows.extend(recovered)
+        return rows, orphans
+
+    @staticmethod
+    def _release_orphans(orphans, adopted: bool):
+        """Borra los spools ajenos ya copiados al propio (adopted) y suelta sus lock."""
+        for path, fd in orphans:
+            try:
+                if adopted:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    # ---------- ciclo de vida ----------
+    async def start(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self._stopping = False
+        await asyncio.to_thread(self._claim_spool)
+        recovered, orphans = await asyncio.to_thread(self._recover_spools)
+        self._rows = recovered + self._rows
+        self._writer = SpoolWriter(self.spool_path)
+        self._writer.start()
+        # el spool queda con solo lo pendiente (también lo de slots huérfanos):
+        # los checkpoints vuelven a contar desde 0
+        self._spool_flushed = 0
+        adopted = False
+        try:
+            await self._writer.submit("rewrite", list(self._rows))
+            adopted = True
+        finally:
+            await asyncio.to_thread(self._release_orphans, orphans, adopted)
+        self._task = asyncio.create_task(self._run())
+        if self._rows:
+            self._wake.set()
+
+    async def stop(self):
+        if self._task:
+            # flag además de cancel(): wait_for puede tragarse la cancelación si
+            # justo se despierta el evento (lote lleno) y el loop seguiría
+            self._stopping = True
+            self._wake.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # ---------- API ----------
+    async def add(self, data: dict):
+        """Bufferea el signup; vuelve cuando la fila está en el spool (fsync compartido)."""
+        data = clean_signup(data)
+        row = {
+            "fullname": data["fullname"],
+            "email": data["email"],
+            "phone": data.get("phone", ""),
+            "client_mac": data.get("client_mac", ""),
+            "client_ip": data.get("client_ip", ""),
+            "ap_mac": data.get("ap_mac", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        # buffer y spool en el mismo orden: los checkpoints cuentan filas desde el principio
+        self._rows.append(row)
+        written = self._writer.submit("append", row)
+        if len(self._rows) >= self.batch_size:
+            self._wake.set()
+        try:
+            await written
+        except OSError as e:
+            # la fila igual se inserta con el próximo lote; solo se pierde si el proceso se cae antes
+            self.errors += 1
+            _logger.warning(f"⚠️ Error escribiendo el spool {self.spool_path}: {e}")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            await self.flush()
+
+    async def _copy_rows(self, conn, rows, records, rejected: list):
+        """
+        COPY dentro de un savepoint; si una fila no entra, parte el lote en dos
+        hasta aislarla. Las que no entran van a `rejected` y el resto se inserta.
+        """
+        try:
+            async with conn.transaction():
+                await conn.copy_records_to_table(TABLE_NAME, records=records, columns=COLUMNS)
+        except ROW_ERRORS as e:
+            if len(rows) == 1:
+                rejected.append((rows[0], str(e)))
+                return
+            mid = len(rows) // 2
+            await self._copy_rows(conn, rows[:mid], records[:mid], rejected)
+            await self._copy_rows(conn, rows[mid:], records[mid:], rejected)
+
+    def _write_rejected(self, rejected):
+        path = os.path.join(self.spool_dir, REJECTED_FILE)
+        with open(path, "a", encoding="utf-8") as f:
+            for row, error in rejected:
+                f.write(json.dumps({"row": row, "error": error}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._rows or self.pool is None:
+                return 0
+
+            batch = self._rows[: max(self.batch_size, 1) * 10]
+            rejected = []
+            try:
+                with DB_FLUSH_SECONDS.time():
+                    async with self.pool.acquire() as conn:
+                        # todo o nada: si se corta la DB a mitad del reparto no queda nada a medias
+                        stamps = await conn.fetch(DB_TIMESTAMPS_SQL, [_arrival(r) for r in batch])
+                        records = [_to_record(r, ts[0]) for r, ts in zip(batch, stamps)]
+                        async with conn.transaction():
+                            await self._copy_rows(conn, batch, records, rejected)
+            except asyncpg.UndefinedTableError:
+                # quedan en buffer + spool hasta que se migre el esquema
+                self.errors += 1
+                _logger.warning(f"⚠️ Tabla '{TABLE_NAME}' inexistente (¿falta python -m services.migrate?)")
+                return 0
+            except Exception as e:
+                # quedan en buffer + spool; se reintenta en el próximo intervalo
+                self.errors += 1
+                _logger.warning(f"⚠️ Error insertando lote de {len(batch)} signups: {e}")
+                return 0
+
+            if rejected:
+                self.rejected += len(rejected)
+                try:
+                    path = await asyncio.to_thread(self._write_rejected, rejected)
+                    _logger.error(f"❌ {len(rejected)} signups rechazados por la DB → {path}")
+                except OSError as e:
+                    _logger.error(f"❌ {len(rejected)} signups rechazados por la DB (sin archivo: {e}): {rejected}")
+
+            # sin awaits entre el recorte y el submit: add() no se intercala y el
+            # checkpoint queda en el spool después de las filas que cubre
+            del self._rows[: len(batch)]
+            if not self._rows:
+                self._spool_flushed = 0
+                written = self._writer.submit("truncate")
+            elif self._spool_flushed + len(batch) >= SPOOL_COMPACT_ROWS:
+                self._spool_flushed = 0
+                written = self._writer.submit("rewrite", list(self._rows))
+            else:
+                self._spool_flushed += len(batch)
+                written = self._writer.submit("checkpoint", self._spool_flushed)
+            try:
+                await written
+            except OSError as e:
+                # si el proceso se cae antes del próximo checkpoint, el lote se inserta de nuevo
+                self.errors += 1
+                _logger.warning(f"⚠️ Error marcando el lote en el spool {self.spool_path}: {e}")
+            inserted = len(batch) - len(rejected)
+            self.flushes += 1
+            self.flushed_rows += inserted
+            if self._rows:
+                self._wake.set()
+
+        # contador incremental; si se pasa max_records el export corre en background
+        await asyncio.to_thread(track_inserts, inserted)
+        return inserted
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._rows),
+            "batch_size": self.batch_size,
+            "interval": self.interval,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "spool": self.spool_path,
+            "spool_fsyncs": self._writer.fsyncs if self._writer else 0,
+        }
+
+
+signup_buffer = SignupBuffer()
@@ -0,0 +1,300 @@
+import asyncio
+import time
+
+import httpx
+
+from services.unifi import config, log_info, log_error
+from services.dispatcher import dispatcher
+from services.mac_cache import mac_cache
+from services.breaker import CircuitBreaker
+from services.routing import resolve_route
+from services.metrics import UNIFI_CALL_SECONDS, UNIFI_CALLS
+from services.session_store import session_store
+
+
+# ------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------
+TIMEOUT = float(config["Unifi"].get("timeout", "4"))
+RETRIES = int(config["Unifi"].get("retries", "2"))
+POOL_SIZE = int(config["Unifi"].get("pool_size", "10"))
+
+# Rutas y header CSRF según modelo
+MODELOS = {
+    2: {"login": "/api/auth/login", "prefix": "/proxy/network", "csrf_header": "X-Csrf-Token"},
+    3: {"login": "/api/login", "prefix": "", "csrf_header": "X-CSRF-Token"},
+    4: {"login": "/api/auth/login", "prefix": "/proxy/network", "csrf_header": "X-Csrf-Token"},
+}
+
+
+# ------------------------------------------------------
+# CLIENTE ASÍNCRONO — UNA CONEXIÓN KEEP-ALIVE POR CONTROLADOR
+# ------------------------------------------------------
+class UnifiController:
+    """Cliente async de un controlador UniFi (login persistente + CSRF)."""
+
+    def __init__(self, ctrl, user, pwd, modelo_n, timeout=TIMEOUT, retries=RETRIES):
+        if modelo_n not in MODELOS:
+            raise ValueError(f"MODELO desconocido: {modelo_n}")
+
+        self.ctrl = ctrl.rstrip("/")
+        self.user = user
+        self.pwd = pwd
+        self.modelo = modelo_n
+        self.key = (self.ctrl, user, modelo_n)
+        self.retries = retries
+        self.paths = MODELOS[modelo_n]
+        self.tag = f"[MODELO{modelo_n}]"
+
+        self.csrf = None
+        self.session_at = 0.0   # "updated" de la sesión en uso (ver session_store)
+        self.breaker = CircuitBreaker(self.ctrl)
+        self._login_lock = asyncio.Lock()
+        self.client = httpx.AsyncClient(
+            base_url=self.ctrl,
+            verify=False,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=POOL_SIZE,
+            ),
+        )
+
+    async def _post_retry(self, path, payload, headers=None):
+        """POST con retry + backoff, sin bloquear el event loop. Fast-fail con circuito abierto."""
+        cmd = payload.get("cmd", "login")
+        start = time.monotonic()
+        result = "no_response"
+        try:
+            for attempt in range(self.retries + 1):
+                if not self.breaker.allow():
+                    log_error(f"{self.tag} Circuito abierto → {self.ctrl} fast-fail")
+                    result = "fast_fail"
+                    return None
+
+                t0 = time.monotonic()
+                try:
+                    r = await self.client.post(path, json=payload, headers=headers)
+                    self.breaker.record(r.status_code < 500, time.monotonic() - t0, f"HTTP {r.status_code}")
+                    result = "ok" if r.status_code == 200 else f"http_{r.status_code}"
+                    return r
+                except asyncio.CancelledError:
+                    # deadline del dispatcher o shutdown: liberar la prueba half-open antes de salir
+                    self.breaker.record_failure("cancelada")
+                    result = "cancelled"
+                    raise
+                except Exception as e:
+                    self.breaker.record_failure(str(e) or type(e).__name__)
+                    log_error(f"{self.tag} [POST_RETRY] Error intento {attempt+1}/{self.retries+1}: {e}")
+                    if attempt < self.retries:
+                        await asyncio.sleep(0.4 * (attempt + 1))  # backoff suave
+            return None
+        finally:
+            # Tiempo total de la llamada (reintentos incluidos) por modelo / comando
+            UNIFI_CALL_SECONDS.observe(time.monotonic() - start, self.modelo, cmd)
+            UNIFI_CALLS.inc(self.modelo, cmd, result)
+
+    def _stamgr(self, site):
+        return f"{self.paths['prefix']}/api/s/{site}/cmd/stamgr"
+
+    def _headers(self):
+        return {self.paths["csrf_header"]: self.csrf or ""}
+
+    def reset(self):
+        self.client.cookies.clear()
+        self.csrf = None
+
+    # ---------- sesión compartida entre workers (services/session_store.py) ----------
+    def _cookies(self) -> dict:
+        return {c.name: c.value for c in self.client.cookies.jar}
+
+    def _adopt(self, shared, stale=None) -> bool:
+        """Usa la sesión (CSRF + cookies) que guardó otro worker, si es nueva y no es la rechazada."""
+        if not shared or shared.get("csrf") in (None, stale, self.csrf):
+            return False
+        if shared.get("updated", 0) <= self.session_at:
+            return False
+        self.client.cookies.clear()
+        for name, value in (shared.get("cookies") or {}).items():
+            self.client.cookies.set(name, value)
+        self.csrf = shared["csrf"]
+        self.session_at = shared.get("updated", 0)
+        return True
+
+    async def login(self, stale=None):
+        # Un solo login concurrente: el resto espera y reutiliza el CSRF nuevo.
+        # stale = CSRF que el controlador rechazó (no sirve reutilizarlo)
+        async with self._login_lock:
+            if self.csrf and self.csrf != stale:
+                return True
+            if self._adopt(session_store.load(self.key), stale):
+                log_info(f"{self.tag} Sesión reutilizada de otro worker")
+                return True
+
+            # Entre procesos: un solo worker hace login, el resto espera el lock
+            fd = await session_store.acquire_login_lock(self.key)
+            try:
+                if self._adopt(session_store.load(self.key), stale):
+                    log_info(f"{self.tag} Sesión reutilizada de otro worker")
+                    return True
+
+                self.reset()
+                login_url = self.paths["login"]
+                log_info(f"{self.tag} LOGIN → {self.ctrl}{login_url}")
+
+                r = await self._post_retry(login_url, {"username": self.user, "password": self.pwd})
+                if not r:
+                    log_error(f"{self.tag} Login FAIL: sin respuesta del controlador")
+                    return False
+
+                if r.status_code != 200:
+                    log_error(f"{self.tag} Login FAIL: {r.status_code} {r.text[:200]}")
+                    return False
+
+                self.csrf = (
+                    r.headers.get("x-csrf-token")
+                    or r.headers.get("x-updated-csrf-token")
+                )
+                log_info(f"{self.tag} CSRF → {self.csrf}")
+                try:
+                    self.session_at = session_store.save(self.key, self.csrf, self._cookies())
+                except OSError as e:
+                    log_error(f"{self.tag} No se pudo guardar la sesión compartida: {e}")
+                return True
+            finally:
+                session_store.release_login_lock(fd)
+
+    async def _stamgr_cmd(self, site, payload):
+        """Comando stamgr; si la sesión expiró (401/403) hace re-login y reintenta."""
+        # Si otro worker ya renovó la sesión, usar esa (evita un 401 seguro)
+        self._adopt(session_store.load(self.key))
+        used = self.csrf
+        r = await self._post_retry(self._stamgr(site), payload, headers=self._headers())
+        if r is not None and r.status_code in (401, 403):
+            log_error(f"{self.tag} Sesión expirada → Re-login")
+            if not await self.login(stale=used):
+                return None
+            r = await self._post_retry(self._stamgr(site), payload, headers=self._headers())
+        return r
+
+    async def unauthorize(self, site, mac):
+        r = await self._stamgr_cmd(site, {"cmd": "unauthorize-guest", "mac": mac})
+        if not r:
+            log_error(f"{self.tag} UNAUTH sin respuesta")
+            return False
+        log_info(f"{self.tag} UNAUTH → {r.status_code}")
+        return True
+
+    async def authorize(self, site, mac, minutes):
+        r = await self._stamgr_cmd(site, {"cmd": "authorize-guest", "mac": mac, "minutes": minutes})
+        if not r:
+            log_error(f"{self.tag} AUTH sin respuesta")
+            return False
+        log_info(f"{self.tag} AUTH → {r.status_code} {r.text[:200]}")
+        return r.status_code == 200
+
+    async def guest_approve(self, site, mac, minutes):
+        if not self.csrf:
+            if not await self.login():
+                return False
+        await self.unauthorize(site, mac)
+        return await self.authorize(site, mac, minutes)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# ------------------------------------------------------
+# REGISTRO DE CONTROLADORES
+# ------------------------------------------------------
+_controllers: dict[tuple, UnifiController] = {}
+
+
+def get_controller(ctrl, user, pwd, modelo_n) -> UnifiController:
+    """Devuelve (o crea) el cliente de ese controlador; se reutiliza entre requests."""
+    key = (ctrl.rstrip("/"), user, modelo_n)
+    c = _controllers.get(key)
+    if c is None:
+        c = UnifiController(ctrl, user, pwd, modelo_n)
+        _controllers[c.key] = c
+    return c
+
+
+def controllers_health() -> dict:
+    """Estado del circuit breaker de cada controlador (para admin / health)."""
+    return {f"{c.ctrl} (modelo {c.modelo})": c.breaker.stats() for c in _controllers.values()}
+
+
+async def close_controllers():
+    for c in list(_controllers.values()):
+        try:
+            await c.aclose()
+        except Exception as e:
+            log_error(f"Error cerrando cliente UniFi: {e}")
+    _controllers.clear()
+
+
+# ------------------------------------------------------
+# DISPATCH GENERAL ASYNC – FUNCIÓN QUE LLAMA main.py
+# ------------------------------------------------------
+async def unifi_guest_approve_async(client_mac: str, ap_mac: str | None, ssid: str | None):
+    if not client_mac:
+        log_error("client_mac vacío")
+        return False
+
+    # Controlador / site / modelo según el AP por el que entró el guest
+    route = resolve_route(ap_mac)
+
+    log_info(
+        f"UNIFI ruta={route.name} modelo={route.modelo} MAC={client_mac} AP={ap_mac} SSID={ssid}"
+    )
+
+    if route.modelo not in MODELOS:
+        log_error(f"MODELO desconocido: {route.modelo}")
+        return False
+
+    # Ya autorizada hace poco (reintentos del navegador cautivo) → sin ir al controlador
+    if mac_cache.is_authorized(route.ctrl, route.site, client_mac):
+        log_info(f"UNIFI MAC={client_mac} ya autorizada (cache)")
+        return True
+
+    try:
+        controller = get_controller(route.ctrl, route.user, route.pwd, route.modelo)
+        # Controlador caído: responder en milisegundos en vez de esperar timeouts
+        if controller.breaker.is_open():
+            log_error(f"Circuito abierto en {controller.ctrl} → MAC={client_mac} fast-fail")
+            return False
+        ok = await dispatcher.submit(controller, route.site, client_mac, route.minutes)
+    except Exception as e:
+        log_error(f"ERROR en unifi_guest_approve_async: {e}")
+        return False
+
+    if ok:
+        mac_cache.add(route.ctrl, route.site, client_mac, route.minutes)
+    return ok
+
+
+async def unifi_guest_revoke_async(client_mac: str, ap_mac: str | None = None):
+    """Revocación desde admin: invalida la cache (en todos los workers) y desautoriza en el controlador."""
+    if not client_mac:
+        return False
+
+    route = resolve_route(ap_mac)
+    try:
+        mac_cache.invalidate(route.ctrl, route.site, client_mac)
+    except OSError as e:
+        # sin el aviso los otros workers siguen con la MAC en cache hasta que venza
+        log_error(f"No se pudo avisar la revocación a los otros workers: {e}")
+
+    if route.modelo not in MODELOS:
+        log_error(f"MODELO desconocido: {route.modelo}")
+        return False
+
+    try:
+        controller = get_controller(route.ctrl, route.user, route.pwd, route.modelo)
+        if not controller.csrf and not await controller.login():
+            return False
+        return await controller.unauthorize(route.site, client_mac)
+    except Exception as e:
+        log_error(f"ERROR en unifi_guest_revoke_async: {e}")
+        return False